@@ -0,0 +1,144 @@
+import html
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+KYIV_TZ = ZoneInfo("Europe/Kyiv")
+TITLE = "ЗАЯВКА НА ПЕРЕВЕЗЕННЯ"
+EMPTY = "—"
+
+FORMAT_PLAIN = "plain"
+FORMAT_HTML = "html"
+FORMAT_COMPACT = "compact"
+FORMATS = (FORMAT_PLAIN, FORMAT_HTML, FORMAT_COMPACT)
+
+# Розмітка заявки: блоки (заголовок або None, поля (ключ, підпис)), між блоками - порожній рядок
+SECTIONS: Tuple[Tuple[Optional[str], Tuple[Tuple[str, str], ...]], ...] = (
+    (None, (("department", "Запит від"),)),
+    ("Вимоги до авто", (("vehicle_type", "Тип авто"),)),
+    ("Ініціатор заявки", (("initiator", "ПІБ"),)),
+    ("Параметри перевезення", (
+        ("company", "Підприємство"),
+        ("cargo_type", "Вид вантажу"),
+        ("size_type", "Габарит / негабарит"),
+        ("volume", "Обсяг"),
+        ("notes", "Примітки"),
+    )),
+    ("Маршрут", (("date_period", "Дата / період перевезення"),)),
+    (None, (
+        ("load_city", "Населений пункт завантаження"),
+        ("load_place", "Склад завантаження"),
+        ("load_method", "Спосіб завантаження"),
+        ("load_contact", "Контакт на завантаженні"),
+    )),
+    (None, (
+        ("unload_city", "Населений пункт розвантаження"),
+        ("unload_place", "Склад розвантаження"),
+        ("unload_method", "Спосіб розвантаження"),
+        ("unload_contact", "Контакт на розвантаженні"),
+    )),
+)
+
+FIELDS: Tuple[Tuple[str, str], ...] = tuple(field for _, fields in SECTIONS for field in fields)
+FIELD_KEYS: Tuple[str, ...] = tuple(key for key, _ in FIELDS)
+FIELD_LABELS: Dict[str, str] = dict(FIELDS)
+
+# Поля однорядкового вигляду (маршрут додається окремо)
+COMPACT_KEYS = ("department", "vehicle_type", "cargo_type", "volume", "date_period")
+
+
+def _compile(heading: str, title: str, escape: Callable[[str], str]) -> str:
+    """Шаблон %-форматування: спершу дата і час, далі значення полів у порядку FIELD_KEYS"""
+
+    def literal(text: str) -> str:
+        return escape(text).replace("%", "%%")
+
+    blocks = []
+    for section, fields in SECTIONS:
+        lines = [heading.format(literal(section + ":"))] if section else []
+        lines += [literal(f"{label}: ") + "%s" for _, label in fields]
+        blocks.append("\n".join(lines))
+    return "Дата: %s\nЧас: %s\n\n" + title + "\n\n" + "\n\n".join(blocks)
+
+
+_PLAIN_TEMPLATE = _compile("{}", TITLE, lambda text: text)
+_HTML_TEMPLATE = _compile("<b>{}</b>", f"<b>{TITLE}</b>", html.escape)
+
+# (хвилина, дата, час) - шапка перераховується не частіше разу на хвилину
+_clock: List[Any] = [None, "", ""]
+
+
+def _now_strings(now: Optional[datetime]) -> Tuple[str, str]:
+    if now is not None:
+        now = now.astimezone(KYIV_TZ) if now.tzinfo else now
+        return now.strftime("%d.%m.%Y"), now.strftime("%H:%M")
+    minute = int(time.time() // 60)
+    if _clock[0] != minute:
+        current = datetime.now(KYIV_TZ)
+        _clock[:] = [minute, current.strftime("%d.%m.%Y"), current.strftime("%H:%M")]
+    return _clock[1], _clock[2]
+
+
+def _values(data: Dict[str, Any], keys: Sequence[str] = FIELD_KEYS) -> List[Any]:
+    get = data.get
+    return [get(key) or EMPTY for key in keys]
+
+
+def render_application(data: Dict[str, Any], fmt: str = FORMAT_PLAIN, now: Optional[datetime] = None) -> str:
+    """Текст заявки: plain - для чату, html - для parse_mode=HTML, compact - один рядок"""
+    if fmt == FORMAT_PLAIN:
+        return _PLAIN_TEMPLATE % (*_now_strings(now), *_values(data))
+    if fmt == FORMAT_HTML:
+        values = [html.escape(str(value), quote=False) for value in _values(data)]
+        return _HTML_TEMPLATE % (*_now_strings(now), *values)
+    if fmt == FORMAT_COMPACT:
+        return render_compact(data)
+    raise ValueError(f"Unknown application format: {fmt}")
+
+
+def render_compact(data: Dict[str, Any]) -> str:
+    """Однорядковий опис: підрозділ · авто · вантаж · обсяг · дата · маршрут"""
+    get = data.get
+    parts = [str(get(key)) for key in COMPACT_KEYS if get(key)]
+    load_city, unload_city = get("load_city"), get("unload_city")
+    if load_city or unload_city:
+        parts.append(f"{load_city or EMPTY} → {unload_city or EMPTY}")
+    return " · ".join(parts).replace("\n", " ") or EMPTY
+
+
+def _normalize_label(label: str) -> str:
+    return " ".join(label.replace(" ", " ").split()).casefold()
+
+
+_LABEL_KEYS: Dict[str, str] = {_normalize_label(label): key for key, label in FIELDS}
+
+
+def parse_application(text: str, aliases: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Поля заявки з тексту у форматі render_application ("Підпис: значення" по рядку).
+
+    aliases - додаткові підписи {підпис: ключ} (наприклад, підписи питань форми).
+    Рядки без відомого підпису дописуються до попереднього поля, заголовки блоків
+    ("Маршрут:") та шапка пропускаються; порожні значення не повертаються.
+    """
+    labels = _LABEL_KEYS
+    if aliases:
+        labels = {**labels, **{_normalize_label(label): key for label, key in aliases.items()}}
+
+    result: Dict[str, str] = {}
+    last_key: Optional[str] = None
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            last_key = None
+            continue
+        label, sep, value = line.partition(":")
+        key = labels.get(_normalize_label(label)) if sep else None
+        if key is not None:
+            value = value.strip()
+            last_key = key if value else None
+            if value:
+                result[key] = value
+        elif last_key is not None and not line.endswith(":"):
+            result[last_key] = f"{result[last_key]}\n{line}"
+    return result
@@ -0,0 +1,481 @@
+"""Навантажувальний тест: N імітованих диспетчерів заповнюють заявки паралельно.
+
+Бот збирається через bot.build_app() і працює проти фейкового Bot API та
+фейкового API Нової Пошти (обидва - локальні aiohttp-сервери). БД - реальний
+PostgreSQL з DATABASE_URL (або --database-url); без неї сценарій із шаблонами
+пропускається, а заявки надсилаються напряму.
+
+    python benchmarks/load_test.py --users 200 --flows 3 --api-latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOT_TOKEN = "123456:LOADTEST"
+TARGET_CHAT_ID = "-1000000000001"
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+SCENARIOS = ("new", "quick", "period", "paste", "paste_edit", "batch", "template")
+CITY_QUERIES = ["Київ", "Вінниця", "Львів", "Одеса", "Житомир", "Черкаси", "Умань", "Полтава"]
+SKIP_BUTTONS = {"⬅️ Назад", "Ввести своє", "Інше", "✍️ Ввести вручну", "⬅️ Назад до підтвердження"}
+MAX_STEPS = 80
+
+
+class FakeTelegram:
+    """Мінімальний Bot API: відповідає на виклики бота і запам'ятовує повідомлення по чатах"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.message_ids = itertools.count(1)
+        self.events: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    def _message(self, chat_id: Any, text: str = "") -> Dict[str, Any]:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            result = self._message(chat_id, params.get("text", ""))
+            markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+            self.events[chat_id].append({
+                "method": method,
+                "message_id": result["message_id"],
+                "text": params.get("text", ""),
+                "markup": markup,
+            })
+            return self._ok(result)
+        # deleteMessage, answerCallbackQuery, pinChatMessage, setWebhook...
+        return self._ok(True)
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeNovaPoshta:
+    """searchSettlements повертає кілька адрес; getSettlements - порожній довідник"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        payload = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if payload.get("calledMethod") != "searchSettlements":
+            return web.json_response({"success": True, "data": []})
+        query = payload["methodProperties"]["CityName"]
+        addresses = [
+            {"Present": f"м. {query}{suffix}", "Area": "Тестова", "Region": "Тестовий"}
+            for suffix in ("", "-1", "-2")
+        ]
+        return web.json_response({"success": True, "data": [{"Addresses": addresses}]})
+
+
+async def _serve(handler_routes: List[web.RouteDef]) -> Tuple[web.AppRunner, int]:
+    web_app = web.Application()
+    web_app.add_routes(handler_routes)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class SimulatedUser:
+    """Диспетчер, що читає останнє питання бота і відповідає згідно зі сценарієм"""
+
+    update_ids = itertools.count(1)
+
+    def __init__(self, harness: "Harness", user_id: int, rng: random.Random):
+        self.harness = harness
+        self.user_id = user_id
+        self.rng = rng
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        self.chat = {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+        self.has_template = False
+        # Після "ТАК" розмова чекає відповіді щодо шаблону, /start там не діє
+        self.next_start = "/start"
+        # paste_edit: None -> "chosen" (обрано поле "Обсяг") -> "done" (на питання відповіли)
+        self.edit_state: Optional[str] = None
+
+    def _message_update(self, text: str) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self.harness.telegram.message_ids),
+            "date": int(time.time()),
+            "chat": self.chat,
+            "from": self.user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def _callback_update(self, data: str, message_id: int) -> Dict[str, Any]:
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": self.user,
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": self.chat,
+                    "from": BOT_USER,
+                    "text": "calendar",
+                },
+            },
+        }
+
+    async def run_flow(self, scenario: str) -> bool:
+        action: Tuple[str, ...] = ("text", self.next_start)
+        if scenario in ("paste", "paste_edit") and self.next_start == "/start":
+            action = ("text", self._pasted_application())
+        self.next_start = "/start"
+        self.edit_state = None
+        for _ in range(MAX_STEPS):
+            events = self.harness.telegram.events[self.user_id]
+            seen = len(events)
+            if action[0] == "text":
+                update = self._message_update(action[1])
+            else:
+                update = self._callback_update(action[1], int(action[2]))
+            await self.harness.send(self.user_id, update)
+            action = self._respond(events[seen:], scenario)
+            if action[0] == "done":
+                return True
+            if action[0] == "fail":
+                logging.warning(f"User {self.user_id} stuck in {scenario}: {action[1]!r}")
+                return False
+            if self.harness.think_time:
+                await asyncio.sleep(self.rng.uniform(0, 2 * self.harness.think_time))
+        return False
+
+    def _pasted_application(self) -> str:
+        """Текст заявки з групи, в якому бракує кількох полів"""
+        import application_text
+
+        data = {
+            "department": self.rng.choice(["Тваринництво", "Виробництво"]),
+            "vehicle_type": "Зерновоз",
+            "initiator": f"Диспетчер {self.user_id}",
+            "company": "Агрокряж",
+            "cargo_type": "Зерно: Пшениця",
+            "size_type": "Насип",
+            "volume": "25 т",
+            "date_period": "01.03.2025",
+            "load_city": "м. Вінниця (Вінницька обл.)",
+            "unload_city": "м. Одеса (Одеська обл.)",
+            "unload_contact": "+380501234567",
+        }
+        for key in self.rng.sample(sorted(data), 3):
+            data.pop(key)
+        return f"📋 @user{self.user_id} створив нову заявку:\n\n" + application_text.render_application(data)
+
+    def _respond(self, events: List[Dict[str, Any]], scenario: str) -> Tuple[str, ...]:
+        for event in reversed(events):
+            action = self._decide(event, scenario)
+            if action is not None:
+                return action
+        return ("fail", events[-1]["text"] if events else "no reply")
+
+    def _decide(self, event: Dict[str, Any], scenario: str) -> Optional[Tuple[str, ...]]:
+        text = event["text"]
+        markup = event["markup"] or {}
+        buttons = [b["text"] for row in markup.get("keyboard", []) for b in row]
+        inline = [b for row in markup.get("inline_keyboard", []) for b in row]
+
+        if text.startswith("✅ Заявку надіслано"):
+            if "Бажаєте зберегти" in text and scenario == "template" and not self.has_template:
+                return ("text", "💾 Зберегти як шаблон")
+            if "Бажаєте зберегти" in text:
+                self.next_start = "📝 Нова заявка"
+            return ("done",)
+        if text.startswith("Як назвати цей шаблон"):
+            return ("text", f"Маршрут {self.user_id}")
+        if text.startswith("✅ Шаблон"):
+            self.has_template = True
+            return ("done",)
+        if "✅" in text and not markup:
+            # echo-відповідь конвеєра прибирання, не питання
+            return None
+        if text == "Що робитимемо?":
+            if scenario == "quick":
+                return ("text", "⚡ Швидка заявка")
+            if scenario == "template" and "📋 Завантажити шаблон" in buttons:
+                return ("text", "📋 Завантажити шаблон")
+            if scenario in ("paste", "paste_edit"):
+                return ("text", self._pasted_application())
+            return ("text", "📝 Нова заявка")
+        if text.startswith("Ви вже заповнюєте"):
+            return ("text", "Почати спочатку")
+        if text.startswith("Оберіть шаблон"):
+            choices = [b for b in inline if b.get("callback_data", "").startswith("TPL:L:")]
+            if choices:
+                return ("callback", choices[0]["callback_data"], str(event["message_id"]))
+            return ("callback", "TPL:Q", str(event["message_id"]))
+        if text.endswith("Запит від:"):
+            return ("text", self.rng.choice([b for b in buttons if b not in SKIP_BUTTONS]))
+        if text == "Оберіть тип перевезення:":
+            return ("text", "📆 Період перевезення" if scenario == "period" else "📅 Разове перевезення")
+        dates = [b for b in inline if b.get("callback_data", "").startswith("CAL:D:")]
+        if dates:
+            return ("callback", self.rng.choice(dates)["callback_data"], str(event["message_id"]))
+        if "Почніть вводити назву" in text or text.startswith("Введіть назву населеного пункту") or text.startswith("🔍"):
+            return ("text", self.rng.choice(CITY_QUERIES))
+        if text.startswith("Оберіть населений пункт"):
+            return ("text", [b for b in buttons if b not in SKIP_BUTTONS][0])
+        if text.startswith("✅ Пакет із"):
+            return ("done",)
+        if text.startswith("📑 Пакет заявок на основі"):
+            return ("text", "Населений пункт розвантаження")
+        if text.startswith("Надішліть значення поля"):
+            return ("text", "\n".join(f"м. Місто-{n}" for n in range(self.rng.randint(5, 30))))
+        if text.startswith("Надіслати пакет із"):
+            return ("text", "📤 Зведення + окремі заявки")
+        if scenario == "paste_edit":
+            action = self._decide_edit(text, buttons)
+            if action is not None:
+                return action
+        if text.startswith("Перевірте заявку") and scenario == "batch":
+            return ("text", "📑 Пакет заявок")
+        if text.startswith("Перевірте заявку"):
+            return ("text", "📤 Надіслати" if "📤 Надіслати" in buttons else "ТАК")
+        choices = [b for b in buttons if b not in SKIP_BUTTONS]
+        if choices:
+            return ("text", self.rng.choice(choices))
+        if markup or event["method"] == "sendMessage":
+            return ("text", f"Тест {self.rng.randint(1, 999)}")
+        return None
+
+
+    def _decide_edit(self, text: str, buttons: List[str]) -> Optional[Tuple[str, ...]]:
+        """Вставлена заявка: змінити вже заповнене поле "Обсяг" з підтвердження"""
+        if text.startswith("Перевірте заявку"):
+            if self.edit_state is None:
+                return ("text", "✏️ Редагувати поля")
+            if self.edit_state != "done":
+                return ("fail", "edit of a filled field skipped straight to confirmation")
+            return None
+        if text == "Оберіть поле для редагування:":
+            self.edit_state = "chosen"
+            return ("text", next(b for b in buttons if b.startswith("Обсяг:")))
+        if self.edit_state == "chosen" and text.startswith("Обсяг"):
+            self.edit_state = "done"
+            return ("text", "30 т")
+        return None
+
+
+class Harness:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.think_time = args.think_time
+        self.telegram = FakeTelegram(args.api_latency)
+        self.novaposhta = FakeNovaPoshta(args.np_latency)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.flow_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.flow_results: Dict[str, List[bool]] = defaultdict(list)
+        self.max_db_in_use = 0
+        self.app = None
+        self.bot_module = None
+
+    async def send(self, user_id: int, data: Dict[str, Any]) -> None:
+        from telegram import Update
+        import db
+
+        app = self.app
+        state = self.bot_module.metrics.CONVERSATIONS.state_of((user_id, user_id)) or "ENTRY"
+        update = Update.de_json(data, app.bot)
+        started = time.perf_counter()
+        # Так само, як Application розподіляє оновлення: через update_processor
+        await app.update_processor.process_update(update, app.process_update(update))
+        self.latencies[state].append(time.perf_counter() - started)
+        self.max_db_in_use = max(self.max_db_in_use, db.get_pool_stats()["in_use"])
+
+    async def run_user(self, index: int, scenarios: List[str]) -> None:
+        rng = random.Random(self.args.seed + index)
+        user = SimulatedUser(self, 10_000 + index, rng)
+        await asyncio.sleep(self.args.ramp * index / max(self.args.users, 1))
+        if "template" in scenarios:
+            # Спершу створити шаблон, який потім завантажуватиметься
+            scenarios = ["template"] + scenarios
+        for scenario in scenarios:
+            started = time.perf_counter()
+            ok = await user.run_flow(scenario)
+            self.flow_results[scenario].append(ok)
+            if ok:
+                self.flow_latencies[scenario].append(time.perf_counter() - started)
+
+    async def run(self) -> Dict[str, Any]:
+        tg_runner, tg_port = await _serve([web.post("/bot{token}/{method}", self.telegram.handle)])
+        np_runner, np_port = await _serve([web.post("/", self.novaposhta.handle)])
+
+        os.environ.update({
+            "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+            "TELEGRAM_API_URL": f"http://127.0.0.1:{tg_port}",
+            "TARGET_CHAT_ID": TARGET_CHAT_ID,
+            "NOVAPOSHTA_API_KEY": "loadtest",
+            "NOVAPOSHTA_API_URL": f"http://127.0.0.1:{np_port}/",
+            "SETTLEMENTS_REFRESH_HOURS": "0",
+            "SETTLEMENTS_DUMP_PATH": os.path.join(tempfile.gettempdir(), "loadtest-settlements-missing.json"),
+            "PERSISTENCE": "1" if self.args.persistence else "0",
+            "UPDATE_WORKERS": str(self.args.workers),
+        })
+        if self.args.database_url:
+            os.environ["DATABASE_URL"] = self.args.database_url
+        if not self.args.telegram_limits:
+            # Міряємо бота, а не ліміти Telegram (20 повідомлень/хв у групу)
+            os.environ.setdefault("OUTBOUND_GROUP_RATE_PER_MINUTE", "600000")
+            os.environ.setdefault("OUTBOUND_CHAT_RATE", "1000")
+            os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "100000")
+
+        import bot
+        import db
+
+        self.bot_module = bot
+        scenarios = [s for s in self.args.scenarios.split(",") if s]
+        if "template" in scenarios and not db.DATABASE_URL:
+            logging.warning("DATABASE_URL is not set - template scenario skipped")
+            scenarios.remove("template")
+        if not db.DATABASE_URL:
+            logging.getLogger("db").setLevel(logging.CRITICAL)
+
+        self.app = bot.build_app()
+        await self.app.initialize()
+        await self.app.post_init(self.app)
+        started = time.perf_counter()
+        try:
+            plans = []
+            for index in range(self.args.users):
+                rng = random.Random(self.args.seed * 7919 + index)
+                plans.append([rng.choice(scenarios) for _ in range(self.args.flows)])
+            await asyncio.gather(*(self.run_user(i, plan) for i, plan in enumerate(plans)))
+            elapsed = time.perf_counter() - started
+        finally:
+            await self.app.post_stop(self.app)
+            await self.app.shutdown()
+            await self.app.post_shutdown(self.app)
+            await tg_runner.cleanup()
+            await np_runner.cleanup()
+        return self.report(elapsed, db.get_pool_stats(), bot.get_city_search_stats())
+
+    def report(self, elapsed: float, pool_stats: Dict[str, float], city_stats: Dict[str, int]) -> Dict[str, Any]:
+        updates = sum(len(v) for v in self.latencies.values())
+        flows = {s: {"ok": sum(r), "failed": len(r) - sum(r)} for s, r in self.flow_results.items()}
+        return {
+            "users": self.args.users,
+            "elapsed_seconds": round(elapsed, 3),
+            "updates": updates,
+            "updates_per_second": round(updates / elapsed, 1) if elapsed else 0,
+            "flows_per_second": round(sum(f["ok"] for f in flows.values()) / elapsed, 2) if elapsed else 0,
+            "flows": flows,
+            "states": {
+                state: {
+                    "count": len(values),
+                    "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                    "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                    "max_ms": round(max(values) * 1000, 2),
+                }
+                for state, values in sorted(self.latencies.items())
+            },
+            "flow_seconds": {
+                scenario: {
+                    "p50": round(percentile(values, 0.50), 3),
+                    "p95": round(percentile(values, 0.95), 3),
+                }
+                for scenario, values in sorted(self.flow_latencies.items())
+            },
+            "db_pool": {**pool_stats, "max_in_use_sampled": self.max_db_in_use},
+            "city_search": city_stats,
+            "telegram_calls": dict(self.telegram.calls),
+            "novaposhta_calls": self.novaposhta.calls,
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\nКористувачів: {report['users']}, тривалість: {report['elapsed_seconds']} с")
+    print(f"Оновлень: {report['updates']} ({report['updates_per_second']}/с), заявок: {report['flows_per_second']}/с")
+    for scenario, result in sorted(report["flows"].items()):
+        timing = report["flow_seconds"].get(scenario, {})
+        print(f"  {scenario:<10} ok={result['ok']:<5} failed={result['failed']:<4} "
+              f"p50={timing.get('p50', 0)}с p95={timing.get('p95', 0)}с")
+    print(f"\n{'Стан':<24}{'к-сть':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for state, stats in report["states"].items():
+        print(f"{state:<24}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+              f"{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    pool = report["db_pool"]
+    print(f"\nПул БД: max_in_use={pool.get('max_in_use', 0)} timeouts={pool.get('timeouts_total', 0)} "
+          f"max_wait={pool.get('max_wait_seconds', 0):.3f}с acquired={pool.get('acquired_total', 0)}")
+    print(f"Пошук НП: {report['city_search']}, викликів API НП: {report['novaposhta_calls']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Навантажувальний тест бота заявок")
+    parser.add_argument("--users", type=int, default=100, help="скільки диспетчерів одночасно")
+    parser.add_argument("--flows", type=int, default=2, help="скільки заявок заповнює кожен")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"набір сценаріїв ({','.join(SCENARIOS)})")
+    parser.add_argument("--ramp", type=float, default=1.0, help="за скільки секунд підключаються всі користувачі")
+    parser.add_argument("--think-time", type=float, default=0.0, help="середня пауза між відповідями, с")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="затримка фейкового Bot API, с")
+    parser.add_argument("--np-latency", type=float, default=0.05, help="затримка фейкового API Нової Пошти, с")
+    parser.add_argument("--workers", type=int, default=16, help="UPDATE_WORKERS")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="PostgreSQL для тесту")
+    parser.add_argument("--persistence", action="store_true", help="увімкнути збереження стану розмов у БД")
+    parser.add_argument("--telegram-limits", action="store_true", help="залишити ліміти частоти Telegram")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="записати звіт у JSON-файл")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    report = asyncio.run(Harness(args).run())
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Мікробенчмарки чистих функцій, через які проходить кожен крок розмови.
+
+Для кожної функції міряється час одного виклику (мінімум з кількох повторів
+timeit) та пікова пам'ять одного виклику (tracemalloc). Результат
+порівнюється з benchmarks/baseline.json; перевищення порогу - код виходу 1.
+
+    python benchmarks/micro.py                 # порівняти з базовою лінією
+    python benchmarks/micro.py --save          # записати нову базову лінію
+    python benchmarks/micro.py -k calendar     # лише бенчмарки з "calendar" у назві
+
+Базова лінія залежить від машини: зберігайте її на тій, де запускаєте перевірку.
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+import application_text  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Допустиме погіршення відносно базової лінії (1.5 - на 50% повільніше; час на спільних машинах шумить)
+DEFAULT_MAX_SLOWDOWN = 1.5
+DEFAULT_MAX_ALLOC_GROWTH = 1.10
+# Поріг пам'яті нижче цього - шум інтерпретатора, а не регресія
+ALLOC_NOISE_BYTES = 256
+
+FULL_APPLICATION = {
+    "department": "Тваринництво",
+    "vehicle_type": "Зерновоз",
+    "initiator": "Петренко Петро Петрович",
+    "company": "Зернопродукт",
+    "cargo_type": "Культура Пшениця",
+    "size_type": "Насип",
+    "volume": "25 т",
+    "notes": "Без перевантаження",
+    "date_period": "01.03.2025 - 05.03.2025",
+    "load_city": "м. Вінниця (Вінницька обл.)",
+    "load_place": "Склад №3",
+    "load_method": "Самоскид",
+    "load_contact": "+380671234567",
+    "unload_city": "м. Одеса (Одеська обл.)",
+    "unload_place": "Порт",
+    "unload_method": "Боковий",
+    "unload_contact": "+380501234567",
+}
+
+QUICK_APPLICATION = {"department": "Тваринництво", "quick_mode": True, "company": "Вінницький ХАБ"}
+
+
+def _walk_questions(data: Dict[str, Any]) -> Callable[[], int]:
+    """Пройти всі питання так, як це робить ask_question після кожної відповіді"""
+    total = len(bot.QUESTIONS)
+
+    def run() -> int:
+        answers = dict(data)
+        index = bot.FLOW.advance(0, answers)
+        while index < total:
+            answers[bot.QUESTIONS[index]["key"]] = "x"
+            index = bot.FLOW.advance(index + 1, answers)
+        return index
+
+    return run
+
+
+def _benchmarks() -> Dict[str, Callable[[], Any]]:
+    options = next(q["options"] for q in bot.QUESTIONS if q.get("options") and len(q["options"]) > 3)
+    build_keyboard = bot._cached_reply_keyboard.__wrapped__
+    build_calendar = bot._build_month_calendar.__wrapped__
+    bot._build_month_calendar(2025, 3)
+    bot._build_reply_keyboard(options, show_back=True)
+    return {
+        "format_application": lambda: bot._format_application(FULL_APPLICATION),
+        "format_application_empty": lambda: bot._format_application({}),
+        "render_application_html": lambda: application_text.render_application(FULL_APPLICATION, "html"),
+        "render_application_compact": lambda: application_text.render_application(FULL_APPLICATION, "compact"),
+        "should_skip_question": lambda: bot._should_skip_question("load_place", QUICK_APPLICATION),
+        "should_skip_question_unknown": lambda: bot._should_skip_question("no_such_key", FULL_APPLICATION),
+        "reply_keyboard_cached": lambda: bot._build_reply_keyboard(options, show_back=True),
+        "reply_keyboard_build": lambda: build_keyboard(tuple(options), True),
+        "reply_keyboard_suggested": lambda: bot._with_suggestions(
+            bot._build_reply_keyboard(options, show_back=True), [options[2], "Склад №3"]
+        ),
+        "month_calendar_cached": lambda: bot._build_month_calendar(2025, 3),
+        "month_calendar_build": lambda: build_calendar(2025, 3),
+        "parse_calendar_date": lambda: bot._parse_calendar_callback("CAL:D:2025-03-14"),
+        "parse_calendar_nav": lambda: bot._parse_calendar_callback("CAL:N:2025-04"),
+        "parse_calendar_ignore": lambda: bot._parse_calendar_callback("CAL:X"),
+        "flow_walk_full": _walk_questions({"department": "Тваринництво"}),
+        "flow_walk_quick": _walk_questions(QUICK_APPLICATION),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """(нс на виклик - мінімум з repeat замірів, пікові байти одного виклику)"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    func()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best * 1e9, max(peak - base, 0)
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    max_slowdown: float,
+    max_alloc_growth: float,
+) -> List[str]:
+    """Список регресій відносно базової лінії"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["ns"] > base["ns"] * max_slowdown:
+            regressions.append(f"{name}: {result['ns']:.0f} нс > {base['ns']:.0f} нс x {max_slowdown}")
+        allowed = max(base["peak_bytes"] * max_alloc_growth, base["peak_bytes"] + ALLOC_NOISE_BYTES)
+        if result["peak_bytes"] > allowed:
+            regressions.append(f"{name}: {result['peak_bytes']} Б > {base['peak_bytes']} Б пам'яті")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Мікробенчмарки чистих функцій бота")
+    parser.add_argument("-k", "--filter", default="", help="лише бенчмарки, що містять цей рядок")
+    parser.add_argument("--repeat", type=int, default=7, help="скільки повторів timeit")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="файл базової лінії")
+    parser.add_argument("--save", action="store_true", help="записати результати як нову базову лінію")
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN)
+    parser.add_argument("--max-alloc-growth", type=float, default=DEFAULT_MAX_ALLOC_GROWTH)
+    args = parser.parse_args()
+
+    baseline: Dict[str, Dict[str, float]] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results: Dict[str, Dict[str, float]] = {}
+    print(f"{'Бенчмарк':<32}{'нс/виклик':>12}{'база':>12}{'Δ':>8}{'пам., Б':>10}")
+    for name, func in _benchmarks().items():
+        if args.filter not in name:
+            continue
+        ns, peak = measure(func, args.repeat)
+        results[name] = {"ns": round(ns, 1), "peak_bytes": peak}
+        base = baseline.get(name)
+        delta = f"{(ns / base['ns'] - 1) * 100:+.0f}%" if base else "нова"
+        print(f"{name:<32}{ns:>12.0f}{base['ns'] if base else 0:>12.0f}{delta:>8}{peak:>10}")
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write("\n")
+        print(f"\nБазову лінію записано: {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.max_slowdown, args.max_alloc_growth)
+    if regressions:
+        print("\nРегресії:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\nРегресій немає")
+
+
+if __name__ == "__main__":
+    main()
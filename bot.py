@@ -1,20 +1,44 @@
 import os
+import asyncio
+import argparse
+import functools
 import logging
 import calendar
-import aiohttp
-import pytz
+import json
+import re
+import tempfile
+import uuid
+from types import SimpleNamespace
 from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, date
 from telegram_bot_calendar import DetailedTelegramCalendar
 import db
+import application_text
+import novaposhta
+import settlements
+import suggestions
+import messaging
+import metrics
+import outbox
+import export
+import webhook
+from persistence import DBPersistence
+from update_processor import PerUserUpdateProcessor, UPDATE_WORKERS
+from cache import TTLCache
+from flow import QuestionFlow, SkipRule
 
 from telegram import (
     Update,
+    Message,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
     KeyboardButton,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+    User,
 )
 from telegram.ext import (
     Application,
@@ -23,8 +47,10 @@ from telegram.ext import (
     ConversationHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     filters,
 )
+from telegram.error import TelegramError
 
 
 logging.basicConfig(
@@ -32,17 +58,67 @@ logging.basicConfig(
     level=logging.INFO,
 )
 
-START, DEPARTMENT, QUESTION, CUSTOM_INPUT, CROP_TYPE, CONFIRM, EDIT, DATE_TYPE, DATE_CALENDAR, DATE_PERIOD_END, LOAD_TEMPLATE, TEMPLATE_SELECT, SAVE_TEMPLATE_NAME, SAVE_TEMPLATE_CONFIRM, DELETE_TEMPLATE_CONFIRM, CITY_SEARCH_LOAD, CITY_SELECT_LOAD, CITY_SEARCH_UNLOAD, CITY_SELECT_UNLOAD = range(19)
+START, DEPARTMENT, QUESTION, CUSTOM_INPUT, CROP_TYPE, CONFIRM, EDIT, DATE_TYPE, DATE_CALENDAR, DATE_PERIOD_END, LOAD_TEMPLATE, TEMPLATE_SELECT, SAVE_TEMPLATE_NAME, SAVE_TEMPLATE_CONFIRM, DELETE_TEMPLATE_CONFIRM, CITY_SEARCH_LOAD, CITY_SELECT_LOAD, CITY_SEARCH_UNLOAD, CITY_SELECT_UNLOAD, BATCH_FIELD, BATCH_VALUES, BATCH_CONFIRM = range(22)
+
+# Назви станів для метрик (у тому ж порядку)
+STATE_NAMES = dict(enumerate((
+    "START", "DEPARTMENT", "QUESTION", "CUSTOM_INPUT", "CROP_TYPE", "CONFIRM", "EDIT", "DATE_TYPE",
+    "DATE_CALENDAR", "DATE_PERIOD_END", "LOAD_TEMPLATE", "TEMPLATE_SELECT", "SAVE_TEMPLATE_NAME",
+    "SAVE_TEMPLATE_CONFIRM", "DELETE_TEMPLATE_CONFIRM", "CITY_SEARCH_LOAD", "CITY_SELECT_LOAD",
+    "CITY_SEARCH_UNLOAD", "CITY_SELECT_UNLOAD", "BATCH_FIELD", "BATCH_VALUES", "BATCH_CONFIRM",
+)))
 
 THREAD_IDS = {
     "Тваринництво": 2,
     "Виробництво": 4,
 }
 
+DEPARTMENT_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton(text=department)] for department in THREAD_IDS],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+
 CROP_TYPES = ["Кукурудза", "Пшениця", "Соя", "Ріпак", "Соняшник"]
 
 LIQUID_BULK_CARGO = {"КАС", "РКД", "АМ вода"}
 
+# Адреса Bot API (локальний telegram-bot-api сервер або тестовий стенд); за замовчуванням - api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Зберігати стан розмов у БД (PERSISTENCE=0 - лише в пам'яті)
+PERSISTENCE_ENABLED = os.getenv("PERSISTENCE", "1").lower() not in {"0", "false", "off"}
+
+# Кому дозволено /export (ID користувачів через кому)
+EXPORT_USER_IDS = {int(x) for x in os.getenv("EXPORT_USER_IDS", "").replace(" ", "").split(",") if x}
+
+# Обмеження на файл імпорту шаблонів
+TEMPLATE_IMPORT_MAX_BYTES = 1024 * 1024
+TEMPLATE_IMPORT_MAX_COUNT = 1000
+
+# Пакет заявок: поля, якими заявки можуть відрізнятися, та максимум заявок у пакеті
+BATCH_FIELDS = ("date_period", "unload_city", "load_city", "volume", "department")
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "30"))
+BATCH_BUTTON = "📑 Пакет заявок"
+BATCH_SEND = "📤 Надіслати зведення"
+BATCH_SEND_EACH = "📤 Зведення + окремі заявки"
+
+# Inline-режим (@bot запит): скільки шаблонів показувати і скільки секунд Telegram кешує відповідь
+INLINE_RESULTS_LIMIT = 20
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+# callback_data кнопок шаблонів: TPL:S:<id> - надіслати, TPL:L:<id> - обрати у списку,
+# TPL:N:<id> / TPL:B:<id> - сторінка після/перед шаблоном, TPL:Q - назад до меню
+TEMPLATE_CALLBACK_PREFIX = "TPL"
+TEMPLATE_PAGE_SIZE = 8
+
+# Кеш результатів пошуку населених пунктів (ключ - нормалізований запит)
+CITY_SEARCH_CACHE_TTL = float(os.getenv("CITY_SEARCH_CACHE_TTL", "21600"))
+CITY_SEARCH_NEGATIVE_TTL = float(os.getenv("CITY_SEARCH_NEGATIVE_TTL", "300"))
+CITY_SEARCH_CACHE_SIZE = int(os.getenv("CITY_SEARCH_CACHE_SIZE", "5000"))
+_city_search_cache = TTLCache(maxsize=CITY_SEARCH_CACHE_SIZE, ttl=CITY_SEARCH_CACHE_TTL)
+_city_search_inflight: Dict[str, "asyncio.Task[List[Dict[str, str]]]"] = {}
+_city_search_stats = {"coalesced": 0}
+
 CAL_PREFIX = "CAL"
 MONTH_NAMES_UK = [
     "Січень",
@@ -162,57 +238,131 @@ QUESTIONS: List[Dict[str, Any]] = [
 ]
 
 
+# Поля, які не запитуються у швидкій заявці
+QUICK_MODE_SKIP = frozenset({
+    "size_type",           # Габарит/негабарит
+    "load_place",         # Склад завантаження
+    "load_method",        # Спосіб завантаження
+    "unload_place",       # Склад розвантаження
+    "unload_method",      # Спосіб розвантаження
+    "load_contact",       # Контакт на завантаженні
+    "unload_contact",     # Контакт на розвантаженні
+    "notes",              # Примітки
+    "company",            # Підприємство (встановлюється автоматично)
+})
+
+# Правила пропуску питань; перше правило, що зачіпає поле, задає автозаповнення
+FLOW_RULES = [
+    # Насип - завжди розвантаження самоскидом
+    SkipRule(flag="bulk", keys=frozenset({"unload_method"}), fill="Самоскид"),
+    SkipRule(flag="liquid_cargo", keys=frozenset({"load_method", "unload_method"})),
+    SkipRule(flag="quick_mode", keys=QUICK_MODE_SKIP),
+]
+FLOW_FLAGS = {
+    "quick_mode": lambda data: data.get("quick_mode"),
+    "liquid_cargo": lambda data: _normalize_cargo_type(data.get("cargo_type")) in LIQUID_BULK_CARGO,
+    "bulk": lambda data: (data.get("size_type") or "").strip() == "Насип",
+}
+FLOW = QuestionFlow(QUESTIONS, FLOW_RULES, FLOW_FLAGS)
+
+# Поля заявки, що зберігаються в шаблонах та у вихідній черзі
+APPLICATION_KEYS = frozenset({q["key"] for q in QUESTIONS} | {
+    "department",
+    "thread_id",
+    "quick_mode",
+    "date_type",
+})
+
+# Поля, які можна пропустити: "—" у вставленій заявці вважається відповіддю
+OPTIONAL_KEYS = frozenset(q["key"] for q in QUESTIONS if "Пропустити" in (q.get("options") or ()))
+# Підписи питань форми, що розпізнаються у вставленій заявці, крім підписів тексту заявки
+PASTE_LABEL_ALIASES = {q["label"]: q["key"] for q in QUESTIONS}
+# Скільки полів має бути розпізнано, щоб повідомлення вважалося заявкою
+MIN_PASTED_FIELDS = 3
+PASTED_APPLICATION_PATTERN = "(?m)^\\s*(" + "|".join(
+    re.escape(label) for label in sorted(
+        {label for _, label in application_text.FIELDS} | set(PASTE_LABEL_ALIASES), key=len, reverse=True
+    )
+) + ")\\s*:"
+
+# Поля, для яких пропонуються найчастіші відповіді користувача (дата щоразу інша)
+SUGGESTED_KEYS = frozenset(q["key"] for q in QUESTIONS if q["key"] != "date_period")
+
+async def _fetch_cities(query: str) -> Optional[List[Dict[str, str]]]:
+    """Пошук без кешу: локальний індекс, потім API (None - помилка API)"""
+    # Спершу локальний індекс, API - лише якщо нічого не знайдено
+    addresses = settlements.search(query, limit=10)
+    if not addresses:
+        client = await novaposhta.get_client()
+        if client is None:
+            return None
+        
+        try:
+            addresses = await client.search_settlements(query, limit=10)
+        except Exception as e:
+            logging.error(f"Error searching cities: {e}")
+            return None
+    
+    results = []
+    for addr in addresses:
+        # Формуємо назву: "Місто (Район, Область)"
+        present = addr.get("Present", "")
+        area = addr.get("Area", "")
+        region = addr.get("Region", "")
+        
+        if area and region:
+            display = f"{present} ({area}, {region})"
+        elif region:
+            display = f"{present} ({region})"
+        else:
+            display = present
+        
+        results.append({
+            "display": display,
+            "value": present
+        })
+    
+    return results[:10]
+
+
+async def _search_and_cache(key: str, query: str) -> List[Dict[str, str]]:
+    try:
+        results = await _fetch_cities(query)
+        if results is None:
+            return []
+        # Порожній результат кешуємо коротше - раптом пункт щойно додали
+        ttl = None if results else CITY_SEARCH_NEGATIVE_TTL
+        _city_search_cache.set(key, results, ttl=ttl)
+        return results
+    finally:
+        _city_search_inflight.pop(key, None)
+
+
+@metrics.timed(metrics.CITY_SEARCH_LATENCY)
 async def search_cities_novaposhta(query: str) -> List[Dict[str, str]]:
     """Пошук населених пунктів через API Нової Пошти"""
-    api_key = os.getenv("NOVAPOSHTA_API_KEY")
-    if not api_key:
-        logging.error("NOVAPOSHTA_API_KEY не встановлено")
+    key = settlements.normalize(query)
+    if not key:
         return []
     
-    url = "https://api.novaposhta.ua/v2.0/json/"
-    payload = {
-        "apiKey": api_key,
-        "modelName": "Address",
-        "calledMethod": "searchSettlements",
-        "methodProperties": {
-            "CityName": query,
-            "Limit": "10"
-        }
-    }
+    cached = _city_search_cache.get(key)
+    if cached is not None:
+        return list(cached)
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                data = await response.json()
-                
-                if not data.get("success"):
-                    return []
-                
-                addresses = data.get("data", [{}])[0].get("Addresses", [])
-                results = []
-                
-                for addr in addresses:
-                    # Формуємо назву: "Місто (Район, Область)"
-                    present = addr.get("Present", "")
-                    area = addr.get("Area", "")
-                    region = addr.get("Region", "")
-                    
-                    if area and region:
-                        display = f"{present} ({area}, {region})"
-                    elif region:
-                        display = f"{present} ({region})"
-                    else:
-                        display = present
-                    
-                    results.append({
-                        "display": display,
-                        "value": present
-                    })
-                
-                return results[:10]
-    except Exception as e:
-        logging.error(f"Error searching cities: {e}")
-        return []
+    # Однакові одночасні запити чекають на один спільний пошук
+    task = _city_search_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_search_and_cache(key, query))
+        _city_search_inflight[key] = task
+    else:
+        _city_search_stats["coalesced"] += 1
+    # shield: скасування одного з очікувачів не скасовує пошук для інших
+    return list(await asyncio.shield(task))
+
+
+def get_city_search_stats() -> Dict[str, int]:
+    """Лічильники кешу пошуку населених пунктів"""
+    return {**_city_search_cache.stats(), **_city_search_stats, "inflight": len(_city_search_inflight)}
 
 
 def _get_question(index: int) -> Dict[str, Any]:
@@ -229,33 +379,77 @@ def _normalize_cargo_type(value: Optional[str]) -> Optional[str]:
 
 
 def _should_skip_question(question_key: str, data: Dict[str, Any]) -> bool:
-    # У швидкій заявці пропускати деякі поля
-    if data.get("quick_mode"):
-        # Поля які пропускати в швидкій режимі
-        quick_mode_skip = {
-            "size_type",           # Габарит/негабарит
-            "load_place",         # Склад завантаження
-            "load_method",        # Спосіб завантаження
-            "unload_place",       # Склад розвантаження
-            "unload_method",      # Спосіб розвантаження
-            "load_contact",       # Контакт на завантаженні
-            "unload_contact",     # Контакт на розвантаженні
-            "notes",              # Примітки
-            "company",            # Підприємство (встановлюється автоматично)
-        }
-        if question_key in quick_mode_skip:
-            return True
-    
-    cargo_type = _normalize_cargo_type(data.get("cargo_type"))
-    if cargo_type in LIQUID_BULK_CARGO and question_key in {"load_method", "unload_method"}:
-        return True
-    size_type = data.get("size_type", "").strip()
-    if size_type == "Насип" and question_key == "unload_method":
-        return True
-    return False
+    return FLOW.should_skip(question_key, data)
+
+
+def _advance_question(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Відповідь на поточне питання прийнято: далі наступне, а при редагуванні - підтвердження"""
+    if context.user_data.pop("editing_mode", None):
+        context.user_data["question_index"] = len(QUESTIONS)
+    else:
+        context.user_data["question_index"] = context.user_data.get("question_index", 0) + 1
+
+
+def _previous_question_index(context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Індекс попереднього питання, яке реально ставилося (пропущені обминаємо)"""
+    # Повернувшись назад, користувач проходить питання по черзі, а не лише відсутні
+    context.user_data.pop("fill_missing", None)
+    return FLOW.previous_index(context.user_data.get("question_index", 0), context.user_data)
+
+
+def _cleanup_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, echo_text: Optional[str] = None) -> None:
+    """Прибрати відповідь користувача та попереднє питання у фоні, не чекаючи Telegram.
+
+    Якщо задано echo_text - попереднє питання замінюється цим текстом ("Питання ✅ відповідь"),
+    інакше видаляється. Якщо питання невідоме, echo_text надсилається новим повідомленням
+    перед наступним питанням (_send_prompt), щоб не опинитися після нього.
+    """
+    chat_id = update.effective_chat.id
+    pipeline = messaging.get_pipeline(context.bot)
+    pipeline.delete(chat_id, update.message.message_id)
+    # Питання вже прибране - не чіпати його вдруге при наступній відповіді
+    last_msg_id = context.user_data.pop("last_question_message_id", None)
+    if echo_text and last_msg_id:
+        pipeline.echo(chat_id, echo_text, replace_message_id=last_msg_id)
+    elif echo_text:
+        context.user_data["pending_echo"] = echo_text
+    else:
+        pipeline.delete(chat_id, last_msg_id)
+
+
+async def _send_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup: Any = None) -> Message:
+    """Надіслати питання через планувальник: ліміти чату та RetryAfter, високий пріоритет"""
+    scheduler = messaging.get_scheduler(context.bot)
+    echo_text = context.user_data.pop("pending_echo", None)
+    if echo_text:
+        try:
+            await scheduler.send_message(update.message.chat_id, echo_text, priority=messaging.PRIORITY_HIGH)
+        except TelegramError as e:
+            logging.error(f"Помилка при надсиланні відповіді перед питанням: {e}")
+    return await scheduler.send_message(
+        update.message.chat_id, text, priority=messaging.PRIORITY_HIGH, reply_markup=reply_markup
+    )
+
+
+async def _ask(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup: Any = None) -> Message:
+    """Поставити питання і запам'ятати його, щоб прибрати після відповіді"""
+    message = await _send_prompt(update, context, text, reply_markup)
+    context.user_data["last_question_message_id"] = message.message_id
+    return message
+
+
+# Скільки різних наборів опцій клавіатур та місяців календаря тримати в кеші.
+# Розмітка в python-telegram-bot v20 незмінна, тож один об'єкт можна віддавати всім.
+KEYBOARD_CACHE_SIZE = 256
+CALENDAR_CACHE_SIZE = 48
 
 
 def _build_reply_keyboard(options: Optional[List[str]], show_back: bool = False) -> Optional[ReplyKeyboardMarkup]:
+    return _cached_reply_keyboard(tuple(options) if options else None, show_back)
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _cached_reply_keyboard(options: Optional[Tuple[str, ...]], show_back: bool) -> Optional[ReplyKeyboardMarkup]:
     if not options:
         keyboard = [[KeyboardButton(text="⬅️ Назад")]] if show_back else None
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True) if keyboard else None
@@ -267,6 +461,19 @@ def _build_reply_keyboard(options: Optional[List[str]], show_back: bool = False)
     return ReplyKeyboardMarkup(buttons, resize_keyboard=True, one_time_keyboard=True)
 
 
+def _with_suggestions(keyboard: ReplyKeyboardMarkup, suggested: List[str]) -> ReplyKeyboardMarkup:
+    """Персональні варіанти над спільною клавіатурою питання.
+
+    Не кешується: набори підказок різні для кожного користувача і витісняли б
+    з _cached_reply_keyboard спільні клавіатури. Кнопки спільної клавіатури
+    перевикористовуються, дублікати підказок з неї прибираються.
+    """
+    rows = [[KeyboardButton(text=value)] for value in suggested]
+    rows += [row for row in keyboard.keyboard if not any(button.text in suggested for button in row)]
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=True)
+
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
 def _build_month_calendar(year: int, month: int) -> InlineKeyboardMarkup:
     rows: List[List[InlineKeyboardButton]] = []
     header_text = f"{MONTH_NAMES_UK[month - 1]} {year}"
@@ -300,6 +507,23 @@ def _build_month_calendar(year: int, month: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+def _precompute_markups() -> None:
+    """Побудувати статичні клавіатури питань та календар на найближчі місяці при старті"""
+    for question in QUESTIONS:
+        if question.get("options"):
+            for show_back in (False, True):
+                _build_reply_keyboard(question["options"], show_back=show_back)
+    _build_reply_keyboard(CROP_TYPES, show_back=True)
+    for show_back in (False, True):
+        _build_reply_keyboard(None, show_back=show_back)
+
+    today = date.today()
+    year, month = today.year, today.month
+    for _ in range(3):
+        _build_month_calendar(year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
 def _parse_calendar_callback(data: str) -> Tuple[str, Optional[str]]:
     if not data or not data.startswith(f"{CAL_PREFIX}:"):
         return "IGNORE", None
@@ -323,48 +547,13 @@ def _parse_calendar_callback(data: str) -> Tuple[str, Optional[str]]:
 
 
 def _format_application(data: Dict[str, Any]) -> str:
-    def val(key: str) -> str:
-        value = data.get(key)
-        return value if value else "—"
-    
-    # Використовуємо часовий пояс Київа (UTC+2)
-    kyiv_tz = pytz.timezone('Europe/Kyiv')
-    now = datetime.now(kyiv_tz)
-    date_str = now.strftime("%d.%m.%Y")
-    time_str = now.strftime("%H:%M")
-
-    return (
-            f"Дата: {date_str}\n"
-            f"Час: {time_str}\n\n"
-        "ЗАЯВКА НА ПЕРЕВЕЗЕННЯ\n\n"
-        f"Запит від: {val('department')}\n\n"
-        "Вимоги до авто:\n"
-        f"Тип авто: {val('vehicle_type')}\n\n"
-        "Ініціатор заявки:\n"
-        f"ПІБ: {val('initiator')}\n\n"
-        "Параметри перевезення:\n"
-        f"Підприємство: {val('company')}\n"
-        f"Вид вантажу: {val('cargo_type')}\n"
-        f"Габарит / негабарит: {val('size_type')}\n"
-        f"Обсяг: {val('volume')}\n"
-        f"Примітки: {val('notes')}\n\n"
-        "Маршрут:\n"
-        f"Дата / період перевезення: {val('date_period')}\n\n"
-        f"Населений пункт завантаження: {val('load_city')}\n"
-        f"Склад завантаження: {val('load_place')}\n"
-        f"Спосіб завантаження: {val('load_method')}\n"
-        f"Контакт на завантаженні: {val('load_contact')}\n\n"
-        f"Населений пункт розвантаження: {val('unload_city')}\n"
-        f"Склад розвантаження: {val('unload_place')}\n"
-        f"Спосіб розвантаження: {val('unload_method')}\n"
-        f"Контакт на розвантаженні: {val('unload_contact')}"
-    )
+    return application_text.render_application(data)
 
 
 async def show_start_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Показати початкове меню: нова заявка або завантажити шаблон"""
     user_id = update.effective_user.id
-    templates = db.get_user_templates(user_id)
+    templates = await db.get_user_templates(user_id)
     
     buttons = [
         [KeyboardButton(text="📝 Нова заявка")],
@@ -383,74 +572,171 @@ async def show_start_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return LOAD_TEMPLATE
 
 
+def _message_update(update: Update) -> SimpleNamespace:
+    """Оновлення від inline-кнопки у вигляді, якого чекають обробники повідомлень (відповідь - у той самий чат)"""
+    return SimpleNamespace(
+        message=update.callback_query.message,
+        effective_user=update.effective_user,
+        effective_chat=update.effective_chat,
+    )
+
+
+async def _templates_page(
+    user_id: int,
+    query: Optional[str],
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+) -> Optional[Tuple[List[Dict[str, Any]], bool, bool]]:
+    """(шаблони сторінки, чи є новіші, чи є старіші) або None при помилці БД"""
+    rows = await db.list_templates_page(user_id, query, after_id, before_id, TEMPLATE_PAGE_SIZE)
+    if rows is None:
+        return None
+    extra = len(rows) > TEMPLATE_PAGE_SIZE
+    if before_id is not None:
+        return rows[-TEMPLATE_PAGE_SIZE:], extra, True
+    return rows[:TEMPLATE_PAGE_SIZE], after_id is not None, extra
+
+
+def _build_templates_keyboard(templates: List[Dict[str, Any]], has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(text=t["name"], callback_data=f"{TEMPLATE_CALLBACK_PREFIX}:L:{t['id']}")]
+        for t in templates
+    ]
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="« Новіші", callback_data=f"{TEMPLATE_CALLBACK_PREFIX}:B:{templates[0]['id']}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Старіші »", callback_data=f"{TEMPLATE_CALLBACK_PREFIX}:N:{templates[-1]['id']}"))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{TEMPLATE_CALLBACK_PREFIX}:Q")])
+    return InlineKeyboardMarkup(rows)
+
+
+def _templates_prompt(context: ContextTypes.DEFAULT_TYPE, found: bool = True) -> str:
+    query = context.user_data.get("template_query")
+    if not found:
+        return f"🔍 За запитом '{query}' шаблонів не знайдено. Надішліть іншу частину назви."
+    prompt = "Оберіть шаблон для видалення" if context.user_data.get("delete_mode") else "Оберіть шаблон"
+    if query:
+        prompt += f" (пошук: {query})"
+    return f"{prompt}:\n🔍 Щоб знайти шаблон, надішліть частину його назви."
+
+
 async def show_templates_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Показати список шаблонів"""
-    user_id = update.effective_user.id
-    templates = db.get_user_templates(user_id)
+    """Показати першу сторінку шаблонів (inline-кнопки з id шаблону)"""
+    context.user_data.pop("template_query", None)
+    page = await _templates_page(update.effective_user.id, None)
     
-    if not templates:
+    if not page or not page[0]:
         await update.message.reply_text(
             "У вас немає збережених шаблонів.",
             reply_markup=ReplyKeyboardRemove()
         )
         return await start(update, context)
     
-    buttons = [[KeyboardButton(text=t["name"])] for t in templates]
-    buttons.append([KeyboardButton(text="⬅️ Назад")])
-    
-    keyboard = ReplyKeyboardMarkup(buttons, resize_keyboard=True, one_time_keyboard=True)
-    await update.message.reply_text(
-        "Оберіть шаблон для видалення:" if context.user_data.get("delete_mode") else "Оберіть шаблон:",
-        reply_markup=keyboard
-    )
+    await update.message.reply_text(_templates_prompt(context), reply_markup=_build_templates_keyboard(*page))
     return TEMPLATE_SELECT
 
 
 async def handle_template_select(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обробка вибору шаблону"""
+    """Текст у списку шаблонів - пошук за назвою (точний збіг одразу обирає шаблон)"""
     text = (update.message.text or "").strip()
     user_id = update.effective_user.id
     
     if text == "⬅️ Назад":
         context.user_data.pop("delete_mode", None)
+        context.user_data.pop("template_query", None)
         return await show_start_menu(update, context)
     
-    templates = db.get_user_templates(user_id)
-    selected_template = None
-    
-    for t in templates:
-        if t["name"] == text:
-            selected_template = db.get_template(t["id"])
-            break
+    page = await _templates_page(user_id, text)
+    if page is None:
+        await update.message.reply_text("Не вдалося завантажити шаблони. Спробуйте ще раз.")
+        return TEMPLATE_SELECT
     
-    if context.user_data.get("delete_mode"):
+    exact = next((t for t in page[0] if t["name"] == text), None)
+    if exact is not None:
+        selected_template = await db.get_template(exact["id"])
         if selected_template:
-            context.user_data["delete_template_id"] = selected_template["id"]
-            context.user_data["delete_template_name"] = selected_template["name"]
-            keyboard = ReplyKeyboardMarkup(
-                [[KeyboardButton(text="✅ Так")], [KeyboardButton(text="❌ Ні")]],
-                resize_keyboard=True,
-                one_time_keyboard=True,
-            )
-            await update.message.reply_text(
-                f"Видалити шаблон '{selected_template['name']}'?",
-                reply_markup=keyboard,
-            )
-            return DELETE_TEMPLATE_CONFIRM
-        await update.message.reply_text("Шаблон не знайдено.")
+            return await _apply_template(update, context, selected_template)
+    
+    context.user_data["template_query"] = text
+    if not page[0]:
+        await update.message.reply_text(
+            _templates_prompt(context, found=False),
+            reply_markup=_build_templates_keyboard([], False, False),
+        )
+        return TEMPLATE_SELECT
+    await update.message.reply_text(_templates_prompt(context), reply_markup=_build_templates_keyboard(*page))
+    return TEMPLATE_SELECT
+
+
+async def handle_template_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Inline-кнопки списку шаблонів: вибір за id, сторінки вперед/назад, повернення до меню"""
+    query = update.callback_query
+    await query.answer()
+    _, action, *rest = query.data.split(":")
+    user_id = update.effective_user.id
+
+    if action == "Q":
+        context.user_data.pop("delete_mode", None)
+        context.user_data.pop("template_query", None)
+        await query.edit_message_reply_markup(reply_markup=None)
+        return await show_start_menu(_message_update(update), context)
+
+    if action in ("N", "B"):
+        cursor = int(rest[0])
+        page = await _templates_page(
+            user_id,
+            context.user_data.get("template_query"),
+            after_id=cursor if action == "N" else None,
+            before_id=cursor if action == "B" else None,
+        )
+        if page and page[0]:
+            await query.edit_message_text(_templates_prompt(context), reply_markup=_build_templates_keyboard(*page))
         return TEMPLATE_SELECT
 
-    if not selected_template:
-        await update.message.reply_text("Шаблон не знайдено.")
+    selected_template = await db.get_template(int(rest[0]))
+    if selected_template is None or selected_template["user_id"] != user_id:
+        await query.message.reply_text("Шаблон не знайдено.")
         return TEMPLATE_SELECT
-    
+    await query.edit_message_text(f"📋 {selected_template['name']}")
+    return await _apply_template(_message_update(update), context, selected_template)
+
+
+async def handle_stale_template_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка зі старого списку шаблонів, коли розмова вже в іншому стані"""
+    await update.callback_query.answer("Список застарів. Відкрийте шаблони знову через /start.", show_alert=True)
+
+
+async def _apply_template(update: Update, context: ContextTypes.DEFAULT_TYPE, selected_template: Dict[str, Any]) -> int:
+    """Обраний шаблон: підтвердити видалення або завантажити в заявку"""
+    context.user_data.pop("template_query", None)
+    if context.user_data.get("delete_mode"):
+        context.user_data["delete_template_id"] = selected_template["id"]
+        context.user_data["delete_template_name"] = selected_template["name"]
+        keyboard = ReplyKeyboardMarkup(
+            [[KeyboardButton(text="✅ Так")], [KeyboardButton(text="❌ Ні")]],
+            resize_keyboard=True,
+            one_time_keyboard=True,
+        )
+        await update.message.reply_text(
+            f"Видалити шаблон '{selected_template['name']}'?",
+            reply_markup=keyboard,
+        )
+        return DELETE_TEMPLATE_CONFIRM
+
+    name = selected_template["name"]
     context.user_data.clear()
     context.user_data.update(selected_template["data"])
+    # Гілка - лише з відомого підрозділу, не з даних шаблону (шаблон міг бути імпортований)
+    thread_id = THREAD_IDS.get(context.user_data.get("department"))
+    context.user_data["thread_id"] = thread_id
     # Якщо в шаблоні вже є department - не запитуємо, одразу до підтвердження
-    if context.user_data.get("department") and context.user_data.get("thread_id"):
+    if thread_id:
         context.user_data["question_index"] = len(QUESTIONS)
         await update.message.reply_text(
-            f"📋 Завантажено шаблон '{text}'\n✅ Запит від: {context.user_data['department']}",
+            f"📋 Завантажено шаблон '{name}'\n✅ Запит від: {context.user_data['department']}",
             reply_markup=ReplyKeyboardRemove()
         )
         return await ask_question(update, context)
@@ -459,16 +745,13 @@ async def handle_template_select(update: Update, context: ContextTypes.DEFAULT_T
     context.user_data.pop("department", None)
     context.user_data.pop("thread_id", None)
     context.user_data["template_loaded"] = True  # Флаг, що це шаблон
-    keyboard = ReplyKeyboardMarkup(
-        [[KeyboardButton(text="Тваринництво")], [KeyboardButton(text="Виробництво")]],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
-    bot_message = await update.message.reply_text(
-        f"📋 Завантажено шаблон '{text}'\n\nЗапит від:",
+    keyboard = DEPARTMENT_KEYBOARD
+    await _ask(
+        update,
+        context,
+        f"📋 Завантажено шаблон '{name}'\n\nЗапит від:",
         reply_markup=keyboard,
     )
-    context.user_data["last_question_message_id"] = bot_message.message_id
     return DEPARTMENT
 
 
@@ -480,7 +763,7 @@ async def handle_delete_template_confirm(update: Update, context: ContextTypes.D
         template_id = context.user_data.get("delete_template_id")
         template_name = context.user_data.get("delete_template_name")
         if template_id:
-            db.delete_template(template_id)
+            await db.delete_template(template_id)
         if template_name:
             await update.message.reply_text(f"✅ Шаблон '{template_name}' видалено.")
         else:
@@ -516,6 +799,39 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return await show_start_menu(update, context)
 
 
+async def handle_pasted_application(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Заявка одним повідомленням (наприклад, скопійована з групи): розпізнати поля, дозапитати відсутні"""
+    parsed = application_text.parse_application(update.message.text or "", PASTE_LABEL_ALIASES)
+    data = {
+        key: value for key, value in parsed.items()
+        if value != application_text.EMPTY or key in OPTIONAL_KEYS
+    }
+    department = data.pop("department", None)
+    if len(data) < MIN_PASTED_FIELDS:
+        await update.message.reply_text(
+            "Не вдалося розпізнати заявку. Вставте текст у форматі \"Підпис: значення\" по рядку."
+        )
+        return await show_start_menu(update, context)
+
+    context.user_data.clear()
+    context.user_data.update(data)
+    if data.get("date_period"):
+        context.user_data["date_type"] = "period" if " - " in data["date_period"] else "single"
+    context.user_data["question_index"] = 0
+    context.user_data["fill_missing"] = True
+    recognized = f"📋 Розпізнано полів: {len(data) + bool(department)} з {len(QUESTIONS) + 1}"
+
+    if department not in THREAD_IDS:
+        # "Запит від:" визначає гілку (thread_id) - без нього питаємо першим
+        await _ask(update, context, f"{recognized}\n\nЗапит від:", reply_markup=DEPARTMENT_KEYBOARD)
+        return DEPARTMENT
+
+    context.user_data["department"] = department
+    context.user_data["thread_id"] = THREAD_IDS[department]
+    await update.message.reply_text(recognized, reply_markup=ReplyKeyboardRemove())
+    return await ask_question(update, context)
+
+
 async def handle_start_menu_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обробка вибору на початковому меню (перед початком або для продовження)"""
     text = (update.message.text or "").strip()
@@ -531,32 +847,26 @@ async def handle_start_menu_choice(update: Update, context: ContextTypes.DEFAULT
     elif text == "Почати спочатку":
         context.user_data.clear()
         context.user_data["question_index"] = 0
-        keyboard = ReplyKeyboardMarkup(
-            [[KeyboardButton(text="Тваринництво")], [KeyboardButton(text="Виробництво")]],
-            resize_keyboard=True,
-            one_time_keyboard=True,
-        )
-        bot_message = await update.message.reply_text(
+        keyboard = DEPARTMENT_KEYBOARD
+        await _ask(
+            update,
+            context,
             "Запит від:",
             reply_markup=keyboard,
         )
-        context.user_data["last_question_message_id"] = bot_message.message_id
         return DEPARTMENT
     # Новий вибір - нова заявка чи шаблон
     elif text == "📝 Нова заявка":
         context.user_data.clear()
         context.user_data["question_index"] = 0
         context.user_data["quick_mode"] = False
-        keyboard = ReplyKeyboardMarkup(
-            [[KeyboardButton(text="Тваринництво")], [KeyboardButton(text="Виробництво")]],
-            resize_keyboard=True,
-            one_time_keyboard=True,
-        )
-        bot_message = await update.message.reply_text(
+        keyboard = DEPARTMENT_KEYBOARD
+        await _ask(
+            update,
+            context,
             "Запит від:",
             reply_markup=keyboard,
         )
-        context.user_data["last_question_message_id"] = bot_message.message_id
         return DEPARTMENT
     
     # Швидка заявка
@@ -565,16 +875,13 @@ async def handle_start_menu_choice(update: Update, context: ContextTypes.DEFAULT
         context.user_data["question_index"] = 0
         context.user_data["quick_mode"] = True
         context.user_data["company"] = "Вінницький ХАБ"  # По замовчуванню
-        keyboard = ReplyKeyboardMarkup(
-            [[KeyboardButton(text="Тваринництво")], [KeyboardButton(text="Виробництво")]],
-            resize_keyboard=True,
-            one_time_keyboard=True,
-        )
-        bot_message = await update.message.reply_text(
+        keyboard = DEPARTMENT_KEYBOARD
+        await _ask(
+            update,
+            context,
             "Запит від:",
             reply_markup=keyboard,
         )
-        context.user_data["last_question_message_id"] = bot_message.message_id
         return DEPARTMENT
     
     # Завантажити шаблон
@@ -598,30 +905,8 @@ async def handle_department(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data["department"] = text
     context.user_data["thread_id"] = THREAD_IDS[text]
     
-    # Видалити повідомлення користувача та попереднє питання
-    try:
-        await update.message.delete()
-    except:
-        pass
-    
-    # Видалити попереднє питання "Запит від:" та показати нове з відповіддю
-    try:
-        last_msg_id = context.user_data.get("last_question_message_id")
-        if last_msg_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=last_msg_id
-                )
-            except:
-                pass
-        # Завжди показати нове повідомлення з відповіддю
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"Запит від: ✅ {text}"
-        )
-    except:
-        pass
+    # Прибрати відповідь користувача, а питання "Запит від:" замінити відповіддю
+    _cleanup_answer(update, context, f"Запит від: ✅ {text}")
     
     # Якщо редагується department - повернутися до підтвердження
     if context.user_data.get("editing_department"):
@@ -652,18 +937,32 @@ async def handle_department(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return await ask_question(update, context)
 
 
+async def _suggested_answers(update: Update, context: ContextTypes.DEFAULT_TYPE, key: str) -> List[str]:
+    """Найчастіші відповіді користувача (та його підрозділу) на питання key"""
+    user = update.effective_user
+    if user is None or key not in SUGGESTED_KEYS:
+        return []
+    return await suggestions.suggest(user.id, context.user_data.get("department"), key)
+
+
+def _record_answers(context: ContextTypes.DEFAULT_TYPE, user_id: int, data: Dict[str, Any]) -> None:
+    """Врахувати відповіді надісланої заявки в підказках (у фоні)"""
+    answers = {key: data.get(key) for key in SUGGESTED_KEYS}
+    context.application.create_task(
+        suggestions.record(user_id, data.get("department"), answers, SUGGESTED_KEYS)
+    )
+
+
 async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    index = context.user_data.get("question_index", 0)
-    while index < len(QUESTIONS) and _should_skip_question(QUESTIONS[index]["key"], context.user_data):
-        q_key = QUESTIONS[index]["key"]
-        if q_key == "unload_method" and context.user_data.get("size_type") == "Насип":
-            context.user_data[q_key] = "Самоскид"
-        else:
-            context.user_data[q_key] = "—"
-        index += 1
-        context.user_data["question_index"] = index
+    # Пропущені питання заповнюються автоматично, індекс - з таблиці переходів
+    # Для вставленої заявки ставляться лише питання, на які ще немає відповіді
+    advance = FLOW.next_missing if context.user_data.get("fill_missing") else FLOW.advance
+    index = advance(context.user_data.get("question_index", 0), context.user_data)
+    context.user_data["question_index"] = index
 
     if index >= len(QUESTIONS):
+        # Відсутні поля заповнено: редагування з підтвердження йде звичайним порядком
+        context.user_data.pop("fill_missing", None)
         application_text = _format_application(context.user_data)
         
         # Для швидкої заявки запитати про додаткову інформацію ДО надіслання
@@ -672,22 +971,31 @@ async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
                 [
                     [KeyboardButton(text="📤 Надіслати")],
                     [KeyboardButton(text="✏️ Додати деталі")],
+                    [KeyboardButton(text=BATCH_BUTTON)],
                 ],
                 resize_keyboard=True,
                 one_time_keyboard=True,
             )
-            await update.message.reply_text(
+            await _send_prompt(
+                update,
+                context,
                 "Перевірте заявку:\n\n" + application_text + "\n\n💡 Це швидка заявка. Хочете додати додаткову інформацію або надіслати як є?",
                 reply_markup=keyboard,
             )
         else:
             # Повна заявка - звичайне підтвердження
             keyboard = ReplyKeyboardMarkup(
-                [[KeyboardButton(text="ТАК")], [KeyboardButton(text="✏️ Редагувати поля")]],
+                [
+                    [KeyboardButton(text="ТАК")],
+                    [KeyboardButton(text="✏️ Редагувати поля")],
+                    [KeyboardButton(text=BATCH_BUTTON)],
+                ],
                 resize_keyboard=True,
                 one_time_keyboard=True,
             )
-            await update.message.reply_text(
+            await _send_prompt(
+                update,
+                context,
                 "Перевірте заявку:\n\n" + application_text + "\n\nНадіслати заявку в чат?",
                 reply_markup=keyboard,
             )
@@ -698,7 +1006,10 @@ async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     # Якщо це питання про населений пункт - запускаємо пошук
     if question.get("use_city_search"):
         show_back = index > 0
-        buttons = []
+        # Часті населені пункти - одним натиском, без пошуку
+        suggested = await _suggested_answers(update, context, question["key"])
+        context.user_data["suggested_cities"] = suggested
+        buttons = [[KeyboardButton(text=city)] for city in suggested]
         if show_back:
             buttons.append([KeyboardButton(text="⬅️ Назад")])
         
@@ -707,8 +1018,7 @@ async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         progress = f"({index + 1}/{len(QUESTIONS)})"
         prompt_with_progress = f"{question['prompt']} {progress}\n\n💡 Почніть вводити назву населеного пункту..."
         
-        bot_message = await update.message.reply_text(prompt_with_progress, reply_markup=keyboard)
-        context.user_data["last_question_message_id"] = bot_message.message_id
+        await _ask(update, context, prompt_with_progress, reply_markup=keyboard)
         
         # Визначаємо стан в залежності від типу пункту
         if question["key"] == "load_city":
@@ -730,21 +1040,26 @@ async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             resize_keyboard=True,
             one_time_keyboard=True,
         )
-        bot_message = await update.message.reply_text(
+        await _ask(
+            update,
+            context,
             "Оберіть тип перевезення:",
             reply_markup=keyboard
         )
-        context.user_data["last_question_message_id"] = bot_message.message_id
         return DATE_TYPE
     
     show_back = index > 0
-    keyboard = _build_reply_keyboard(question.get("options"), show_back=show_back)
+    options = question.get("options")
+    suggested = await _suggested_answers(update, context, question["key"])
+    if suggested:
+        keyboard = _with_suggestions(_build_reply_keyboard(options or ["Ввести своє"], show_back=show_back), suggested)
+    else:
+        keyboard = _build_reply_keyboard(options, show_back=show_back)
     # Прогрес-бар: показувати скільки питань вміще
     progress = f"({index + 1}/{len(QUESTIONS)})"
     prompt_with_progress = f"{question['prompt']} {progress}"
     # Зберегти message_id щоб потім редагувати
-    bot_message = await update.message.reply_text(prompt_with_progress, reply_markup=keyboard)
-    context.user_data["last_question_message_id"] = bot_message.message_id
+    await _ask(update, context, prompt_with_progress, reply_markup=keyboard)
     return QUESTION
 
 
@@ -756,12 +1071,9 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     # Обробка кнопки Назад
     if text == "⬅️ Назад":
         # Видалити повідомлення користувача
-        try:
-            await update.message.delete()
-        except:
-            pass
+        messaging.get_pipeline(context.bot).delete(update.effective_chat.id, update.message.message_id)
         if index > 0:
-            context.user_data["question_index"] = index - 1
+            context.user_data["question_index"] = _previous_question_index(context)
             return await ask_question(update, context)
         else:
             await update.message.reply_text("Ви вже на першому питанні.")
@@ -789,26 +1101,11 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         context.user_data["cargo_type_prefix"] = text
         keyboard = _build_reply_keyboard(CROP_TYPES, show_back=True)
         
-        # Видалити відповідь користувача
-        try:
-            await update.message.delete()
-        except:
-            pass
-        
-        # Видалити попереднє питання "Вид вантажу:"
-        try:
-            last_msg_id = context.user_data.get("last_question_message_id")
-            if last_msg_id:
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=last_msg_id
-                )
-        except:
-            pass
+        # Видалити відповідь користувача та попереднє питання "Вид вантажу:"
+        _cleanup_answer(update, context)
         
         # Зберегти message_id нового питання про культуру
-        bot_message = await update.message.reply_text("Оберіть культуру:", reply_markup=keyboard)
-        context.user_data["last_question_message_id"] = bot_message.message_id
+        await _ask(update, context, "Оберіть культуру:", reply_markup=keyboard)
         return CROP_TYPE
     
     # Обробка "Інше" для cargo_type
@@ -828,37 +1125,11 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         else:
             context.user_data[question["key"]] = text
 
-    # Видалити повідомлення користувача та попереднє питання бота
-    try:
-        await update.message.delete()
-        # Видалити попереднє питання бота
-        last_msg_id = context.user_data.get("last_question_message_id")
-        if last_msg_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=last_msg_id
-                )
-            except:
-                pass
-            # Надіслати нове повідомлення з відповіддю
-            answer_value = context.user_data.get(question["key"], "—")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"{question['prompt']} ✅ {answer_value}"
-            )
-    except Exception as e:
-        # Логувати помилку
-        logging.error(f"Помилка при оновленні повідомлення: {e}")
-        pass
+    # Видалити повідомлення користувача, а питання бота замінити відповіддю
+    answer_value = context.user_data.get(question["key"], "—")
+    _cleanup_answer(update, context, f"{question['prompt']} ✅ {answer_value}")
 
-    # Якщо редагуємо - повертаємо до підтвердження
-    if context.user_data.get("editing_mode"):
-        context.user_data.pop("editing_mode", None)
-        context.user_data["question_index"] = len(QUESTIONS)
-        return await ask_question(update, context)
-    
-    context.user_data["question_index"] = index + 1
+    _advance_question(context)
     return await ask_question(update, context)
 
 
@@ -893,35 +1164,10 @@ async def handle_custom_input(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     context.user_data["awaiting_custom"] = False
     
-    # Видалити повідомлення користувача та попереднє питання бота
-    try:
-        await update.message.delete()
-        # Видалити попереднє питання бота
-        last_msg_id = context.user_data.get("last_question_message_id")
-        if last_msg_id:
-            try:
-                await context.bot.delete_message(
-                    chat_id=update.effective_chat.id,
-                    message_id=last_msg_id
-                )
-            except:
-                pass
-            # Надіслати нове повідомлення з відповіддю
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=display_text
-            )
-    except Exception as e:
-        logging.error(f"Помилка при обробці кастомного введення: {e}")
-        pass
-    
-    # Якщо редагуємо - повертаємо до підтвердження
-    if context.user_data.get("editing_mode"):
-        context.user_data.pop("editing_mode", None)
-        context.user_data["question_index"] = len(QUESTIONS)
-        return await ask_question(update, context)
+    # Видалити повідомлення користувача, а питання бота замінити відповіддю
+    _cleanup_answer(update, context, display_text)
     
-    context.user_data["question_index"] = index + 1
+    _advance_question(context)
     return await ask_question(update, context)
 
 
@@ -939,34 +1185,11 @@ async def handle_crop_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         context.user_data["cargo_type"] = f"{prefix}: {text}"
         context.user_data.pop("awaiting_custom_crop", None)
         context.user_data.pop("cargo_type_prefix", None)
-        index = context.user_data.get("question_index", 0)
         
-        # Видалити повідомлення користувача та попереднє питання
-        try:
-            await update.message.delete()
-            last_msg_id = context.user_data.get("last_question_message_id")
-            if last_msg_id:
-                try:
-                    await context.bot.delete_message(
-                        chat_id=update.effective_chat.id,
-                        message_id=last_msg_id
-                    )
-                except:
-                    pass
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"Оберіть культуру: ✅ {text}"
-                )
-        except:
-            pass
-        
-        # Якщо редагуємо - повертаємо до підтвердження
-        if context.user_data.get("editing_mode"):
-            context.user_data.pop("editing_mode", None)
-            context.user_data["question_index"] = len(QUESTIONS)
-            return await ask_question(update, context)
+        # Видалити повідомлення користувача, а питання замінити відповіддю
+        _cleanup_answer(update, context, f"Оберіть культуру: ✅ {text}")
         
-        context.user_data["question_index"] = index + 1
+        _advance_question(context)
         return await ask_question(update, context)
     
     # Якщо вибрано зі списку
@@ -974,34 +1197,11 @@ async def handle_crop_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         prefix = context.user_data.get("cargo_type_prefix", "Зерно")
         context.user_data["cargo_type"] = f"{prefix}: {text}"
         context.user_data.pop("cargo_type_prefix", None)
-        index = context.user_data.get("question_index", 0)
-        
-        # Видалити повідомлення користувача та попереднє питання
-        try:
-            await update.message.delete()
-            last_msg_id = context.user_data.get("last_question_message_id")
-            if last_msg_id:
-                try:
-                    await context.bot.delete_message(
-                        chat_id=update.effective_chat.id,
-                        message_id=last_msg_id
-                    )
-                except:
-                    pass
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"Вид вантажу: {prefix} ✅ {text}"
-                )
-        except:
-            pass
         
-        # Якщо редагуємо - повертаємо до підтвердження
-        if context.user_data.get("editing_mode"):
-            context.user_data.pop("editing_mode", None)
-            context.user_data["question_index"] = len(QUESTIONS)
-            return await ask_question(update, context)
+        # Видалити повідомлення користувача, а питання замінити відповіддю
+        _cleanup_answer(update, context, f"Вид вантажу: {prefix} ✅ {text}")
         
-        context.user_data["question_index"] = index + 1
+        _advance_question(context)
         return await ask_question(update, context)
     else:
         await update.message.reply_text("Будь ласка, оберіть культуру зі списку або натисніть 'Ввести своє'.")
@@ -1015,33 +1215,13 @@ async def handle_date_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if text == "⬅️ Назад":
         index = context.user_data.get("question_index", 0)
         if index > 0:
-            context.user_data["question_index"] = index - 1
+            context.user_data["question_index"] = _previous_question_index(context)
             return await ask_question(update, context)
     
     if text == "📅 Разове перевезення":
         context.user_data["date_type"] = "single"
-        # Видалити повідомлення користувача
-        try:
-            await update.message.delete()
-        except:
-            pass
-        # Показати нове повідомлення з відповідю
-        try:
-            last_msg_id = context.user_data.get("last_question_message_id")
-            if last_msg_id:
-                try:
-                    await context.bot.delete_message(
-                        chat_id=update.effective_chat.id,
-                        message_id=last_msg_id
-                    )
-                except:
-                    pass
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Оберіть тип перевезення: 📅 Разове ✅"
-            )
-        except:
-            pass
+        # Видалити повідомлення користувача, а питання замінити відповіддю
+        _cleanup_answer(update, context, "Оберіть тип перевезення: 📅 Разове ✅")
         today = date.today()
         calendar = _build_month_calendar(today.year, today.month)
         await update.message.reply_text(
@@ -1051,28 +1231,8 @@ async def handle_date_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return DATE_CALENDAR
     elif text == "📆 Період перевезення":
         context.user_data["date_type"] = "period"
-        # Видалити повідомлення користувача
-        try:
-            await update.message.delete()
-        except:
-            pass
-        # Показати нове повідомлення з відповідю
-        try:
-            last_msg_id = context.user_data.get("last_question_message_id")
-            if last_msg_id:
-                try:
-                    await context.bot.delete_message(
-                        chat_id=update.effective_chat.id,
-                        message_id=last_msg_id
-                    )
-                except:
-                    pass
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Оберіть тип перевезення: 📆 Період ✅"
-            )
-        except:
-            pass
+        # Видалити повідомлення користувача, а питання замінити відповіддю
+        _cleanup_answer(update, context, "Оберіть тип перевезення: 📆 Період ✅")
         today = date.today()
         calendar = _build_month_calendar(today.year, today.month)
         await update.message.reply_text(
@@ -1107,12 +1267,7 @@ async def handle_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.callback_query.edit_message_text(f"Дата перевезення: {selected_date}")
             
             # Переходимо до наступного питання або підтвердження
-            if context.user_data.get("editing_mode"):
-                context.user_data.pop("editing_mode", None)
-                context.user_data["question_index"] = len(QUESTIONS)
-            else:
-                index = context.user_data.get("question_index", 0)
-                context.user_data["question_index"] = index + 1
+            _advance_question(context)
             
             # Створюємо фейковий update для ask_question
             class FakeMessage:
@@ -1164,12 +1319,7 @@ async def handle_period_end(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         
         # Переходимо до наступного питання
-        if context.user_data.get("editing_mode"):
-            context.user_data.pop("editing_mode", None)
-            context.user_data["question_index"] = len(QUESTIONS)
-        else:
-            index = context.user_data.get("question_index", 0)
-            context.user_data["question_index"] = index + 1
+        _advance_question(context)
         
         class FakeMessage:
             def __init__(self, chat_id):
@@ -1191,9 +1341,12 @@ async def handle_city_search_load(update: Update, context: ContextTypes.DEFAULT_
     if text == "⬅️ Назад":
         index = context.user_data.get("question_index", 0)
         if index > 0:
-            context.user_data["question_index"] = index - 1
+            context.user_data["question_index"] = _previous_question_index(context)
         return await ask_question(update, context)
     
+    if text in context.user_data.get("suggested_cities", ()):
+        return await handle_city_select_load(update, context)
+    
     # Пошук міст
     cities = await search_cities_novaposhta(text)
     
@@ -1230,7 +1383,7 @@ async def handle_city_select_load(update: Update, context: ContextTypes.DEFAULT_
     if text == "⬅️ Назад":
         index = context.user_data.get("question_index", 0)
         if index > 0:
-            context.user_data["question_index"] = index - 1
+            context.user_data["question_index"] = _previous_question_index(context)
         return await ask_question(update, context)
     
     if text == "✍️ Ввести вручну":
@@ -1244,32 +1397,14 @@ async def handle_city_select_load(update: Update, context: ContextTypes.DEFAULT_
     context.user_data["load_city"] = text
     
     # Видалити повідомлення та перейти до наступного питання
-    try:
-        await update.message.delete()
-        last_msg_id = context.user_data.get("last_question_message_id")
-        if last_msg_id:
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=last_msg_id
-            )
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"Населений пункт завантаження: ✅ {text}"
-        )
-    except:
-        pass
+    _cleanup_answer(update, context, f"Населений пункт завантаження: ✅ {text}")
     
     if context.user_data.get("editing_mode"):
-        context.user_data.pop("editing_mode", None)
-        context.user_data["question_index"] = len(QUESTIONS)
         await update.message.reply_text(
             f"✅ Змінено на '{text}'",
             reply_markup=ReplyKeyboardRemove(),
         )
-        return await ask_question(update, context)
-    
-    index = context.user_data.get("question_index", 0)
-    context.user_data["question_index"] = index + 1
+    _advance_question(context)
     return await ask_question(update, context)
 
 
@@ -1280,9 +1415,12 @@ async def handle_city_search_unload(update: Update, context: ContextTypes.DEFAUL
     if text == "⬅️ Назад":
         index = context.user_data.get("question_index", 0)
         if index > 0:
-            context.user_data["question_index"] = index - 1
+            context.user_data["question_index"] = _previous_question_index(context)
         return await ask_question(update, context)
     
+    if text in context.user_data.get("suggested_cities", ()):
+        return await handle_city_select_unload(update, context)
+    
     # Пошук міст
     cities = await search_cities_novaposhta(text)
     
@@ -1319,7 +1457,7 @@ async def handle_city_select_unload(update: Update, context: ContextTypes.DEFAUL
     if text == "⬅️ Назад":
         index = context.user_data.get("question_index", 0)
         if index > 0:
-            context.user_data["question_index"] = index - 1
+            context.user_data["question_index"] = _previous_question_index(context)
         return await ask_question(update, context)
     
     if text == "✍️ Ввести вручну":
@@ -1333,32 +1471,14 @@ async def handle_city_select_unload(update: Update, context: ContextTypes.DEFAUL
     context.user_data["unload_city"] = text
     
     # Видалити повідомлення та перейти до наступного питання
-    try:
-        await update.message.delete()
-        last_msg_id = context.user_data.get("last_question_message_id")
-        if last_msg_id:
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=last_msg_id
-            )
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"Населений пункт розвантаження: ✅ {text}"
-        )
-    except:
-        pass
+    _cleanup_answer(update, context, f"Населений пункт розвантаження: ✅ {text}")
     
     if context.user_data.get("editing_mode"):
-        context.user_data.pop("editing_mode", None)
-        context.user_data["question_index"] = len(QUESTIONS)
         await update.message.reply_text(
             f"✅ Змінено на '{text}'",
             reply_markup=ReplyKeyboardRemove(),
         )
-        return await ask_question(update, context)
-    
-    index = context.user_data.get("question_index", 0)
-    context.user_data["question_index"] = index + 1
+    _advance_question(context)
     return await ask_question(update, context)
 
 
@@ -1395,12 +1515,10 @@ async def handle_edit_choice(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     # Перевірити, чи редагується "Запит від:"
     if text.startswith("Запит від:"):
-        keyboard = ReplyKeyboardMarkup(
-            [[KeyboardButton(text="Тваринництво")], [KeyboardButton(text="Виробництво")]],
-            resize_keyboard=True,
-            one_time_keyboard=True,
-        )
-        await update.message.reply_text(
+        keyboard = DEPARTMENT_KEYBOARD
+        await _ask(
+            update,
+            context,
             "Запит від:",
             reply_markup=keyboard,
         )
@@ -1418,9 +1536,263 @@ async def handle_edit_choice(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return EDIT
 
 
+def _user_mention(user: User) -> str:
+    return f"@{user.username}" if user.username else user.full_name
+
+
+def _application_notification(user: User, data: Dict[str, Any]) -> str:
+    return f"📋 {_user_mention(user)} створив нову заявку:\n\n{_format_application(data)}"
+
+
+async def _deliver_application(
+    context: ContextTypes.DEFAULT_TYPE,
+    user: User,
+    data: Dict[str, Any],
+    chat_id: str,
+    key: str,
+) -> bool:
+    """Записати заявку у вихідну чергу (доставку в групу виконує outbox), без БД - надіслати напряму"""
+    notification = _application_notification(user, data)
+    thread_id = data.get("thread_id")
+
+    if db.DATABASE_URL:
+        payload = {k: v for k, v in data.items() if k in APPLICATION_KEYS}
+        application_id = await db.enqueue_application(key, user.id, chat_id, thread_id, payload, notification)
+        if application_id is not None:
+            outbox.notify()
+            return True
+        logging.warning("Outbox недоступний, заявка надсилається напряму")
+
+    try:
+        await messaging.get_scheduler(context.bot).send_message(
+            chat_id=chat_id,
+            text=notification,
+            message_thread_id=thread_id,
+            priority=messaging.PRIORITY_HIGH,
+        )
+    except TelegramError as e:
+        logging.error(f"Помилка при надсиланні заявки: {e}")
+        return False
+    return True
+
+
+async def _submit_application(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: str) -> bool:
+    """Надіслати заявку, заповнену в розмові"""
+    # Ключ живе в user_data до успішного запису: повторне підтвердження не дублює заявку
+    key = context.user_data.setdefault("application_key", uuid.uuid4().hex)
+    if not await _deliver_application(context, update.effective_user, context.user_data, chat_id, key):
+        return False
+    context.user_data.pop("application_key", None)
+    _record_answers(context, update.effective_user.id, context.user_data)
+    return True
+
+
+def _batch_items(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Заявки пакета: базова заявка з кожним зі значень змінного поля"""
+    field = data["batch_field"]
+    base = {k: v for k, v in data.items() if k in APPLICATION_KEYS}
+    items = []
+    for value in data["batch_values"]:
+        item = {**base, field: value}
+        if field == "department":
+            item["thread_id"] = THREAD_IDS[value]
+        elif field == "date_period":
+            item["date_type"] = "period" if " - " in value else "single"
+        items.append(item)
+    return items
+
+
+def _batch_groups(items: List[Dict[str, Any]]) -> Dict[Optional[int], List[Dict[str, Any]]]:
+    """Заявки пакета за гілками групи (зведення надсилається в кожну гілку окремо)"""
+    groups: Dict[Optional[int], List[Dict[str, Any]]] = {}
+    for item in items:
+        groups.setdefault(item.get("thread_id"), []).append(item)
+    return groups
+
+
+def _format_batch_summary(items: List[Dict[str, Any]], field: str) -> str:
+    """Спільні поля пакета один раз і нумерований список значень змінного поля"""
+    values = [item.get(field) or application_text.EMPTY for item in items]
+    if len(set(values)) == 1:
+        return _format_application(items[0])
+    label = application_text.FIELD_LABELS[field]
+    listing = "\n".join(f"{number}. {value}" for number, value in enumerate(values, 1))
+    base = {**items[0], field: "див. список нижче"}
+    return f"{_format_application(base)}\n\n{label} ({len(values)}):\n{listing}"
+
+
+async def _submit_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: str, individual: bool) -> bool:
+    """Надіслати пакет: зведення в кожну гілку та, за бажанням, окремі заявки"""
+    user = update.effective_user
+    field = context.user_data["batch_field"]
+    items = _batch_items(context.user_data)
+    # Ключ пакета живе до успішного запису: повторне натискання не дублює повідомлення
+    batch_key = context.user_data.setdefault("batch_key", uuid.uuid4().hex)
+
+    # (ключ, гілка, payload, текст, пріоритет, вид рядка, статус у черзі)
+    outgoing = []
+    for thread_id, group in _batch_groups(items).items():
+        summary = f"📑 {_user_mention(user)} створив пакет заявок ({len(group)}):\n\n{_format_batch_summary(group, field)}"
+        payload = {**group[0], "batch_field": field, "batch_values": [item.get(field) for item in group]}
+        outgoing.append((
+            f"{batch_key}:summary:{thread_id}", thread_id, payload, summary, messaging.PRIORITY_HIGH,
+            db.BATCH_SUMMARY_KIND, "pending",
+        ))
+    # Кожна заявка пакета - окремий рядок історії; без окремих повідомлень її вже доставляє зведення
+    for number, item in enumerate(items):
+        outgoing.append((
+            f"{batch_key}:{number}", item.get("thread_id"), item,
+            _application_notification(user, item), messaging.PRIORITY_NORMAL,
+            db.APPLICATION_KIND, "pending" if individual else "batched",
+        ))
+
+    if db.DATABASE_URL:
+        # Доставку виконує outbox з лімітами частоти планувальника
+        queued = [(key, thread_id, payload, text, kind, status) for key, thread_id, payload, text, _, kind, status in outgoing]
+        if await db.enqueue_applications(user.id, chat_id, queued):
+            outbox.notify()
+            delivered = True
+        else:
+            delivered = False
+            logging.warning("Outbox недоступний, пакет надсилається напряму")
+    else:
+        delivered = False
+
+    if not delivered:
+        scheduler = messaging.get_scheduler(context.bot)
+        results = await asyncio.gather(
+            *(
+                scheduler.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id, priority=priority)
+                for _, thread_id, _, text, priority, _, status in outgoing
+                if status == "pending"
+            ),
+            return_exceptions=True,
+        )
+        failed = [result for result in results if isinstance(result, BaseException)]
+        if failed:
+            logging.error(f"Пакет заявок: не надіслано {len(failed)} з {len(results)} повідомлень: {failed[0]}")
+            return False
+
+    context.user_data.pop("batch_key", None)
+    # Підказки враховують пакет як одну заявку, інакше він перекосив би частоти
+    _record_answers(context, user.id, items[0])
+    return True
+
+
+async def show_batch_fields(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Пакет заявок: вибір поля, яким заявки відрізняються"""
+    buttons = [[KeyboardButton(text=application_text.FIELD_LABELS[key])] for key in BATCH_FIELDS]
+    buttons.append([KeyboardButton(text="⬅️ Назад до підтвердження")])
+    await update.message.reply_text(
+        "📑 Пакет заявок на основі цієї заявки. Чим відрізнятимуться заявки?",
+        reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True, one_time_keyboard=True),
+    )
+    return BATCH_FIELD
+
+
+async def _back_to_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    for key in ("batch_field", "batch_values", "batch_key"):
+        context.user_data.pop(key, None)
+    context.user_data["question_index"] = len(QUESTIONS)
+    return await ask_question(update, context)
+
+
+async def handle_batch_field(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text = (update.message.text or "").strip()
+    if text == "⬅️ Назад до підтвердження":
+        return await _back_to_confirm(update, context)
+
+    field = next((key for key in BATCH_FIELDS if application_text.FIELD_LABELS[key] == text), None)
+    if field is None:
+        await update.message.reply_text("Будь ласка, оберіть поле зі списку.")
+        return BATCH_FIELD
+
+    context.user_data["batch_field"] = field
+    hint = f"Доступні: {', '.join(THREAD_IDS)}" if field == "department" else "Наприклад:\n01.03.2025\n02.03.2025"
+    await update.message.reply_text(
+        f"Надішліть значення поля \"{text}\" одним повідомленням, кожне з нового рядка (до {BATCH_MAX_SIZE}).\n\n{hint}",
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton(text="⬅️ Назад")]], resize_keyboard=True, one_time_keyboard=True),
+    )
+    return BATCH_VALUES
+
+
+async def handle_batch_values(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text = (update.message.text or "").strip()
+    if text == "⬅️ Назад":
+        return await show_batch_fields(update, context)
+
+    values = [line.strip() for line in text.splitlines() if line.strip()]
+    if not values or len(values) > BATCH_MAX_SIZE:
+        await update.message.reply_text(f"Потрібно від 1 до {BATCH_MAX_SIZE} значень, кожне з нового рядка.")
+        return BATCH_VALUES
+    if context.user_data["batch_field"] == "department":
+        unknown = [value for value in values if value not in THREAD_IDS]
+        if unknown:
+            await update.message.reply_text(f"Невідомі підрозділи: {', '.join(unknown)}. Доступні: {', '.join(THREAD_IDS)}")
+            return BATCH_VALUES
+
+    context.user_data["batch_values"] = values
+    field = context.user_data["batch_field"]
+    items = _batch_items(context.user_data)
+    for group in _batch_groups(items).values():
+        await update.message.reply_text(f"Зведення ({len(group)}):\n\n{_format_batch_summary(group, field)}")
+
+    keyboard = ReplyKeyboardMarkup(
+        [
+            [KeyboardButton(text=BATCH_SEND)],
+            [KeyboardButton(text=BATCH_SEND_EACH)],
+            [KeyboardButton(text="✏️ Змінити значення")],
+            [KeyboardButton(text="⬅️ Назад до підтвердження")],
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+    await update.message.reply_text(
+        f"Надіслати пакет із {len(items)} заявок? Зведення - одне повідомлення на гілку, "
+        "окремі заявки - ще по повідомленню на кожну.",
+        reply_markup=keyboard,
+    )
+    return BATCH_CONFIRM
+
+
+async def handle_batch_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text = (update.message.text or "").strip()
+    if text == "⬅️ Назад до підтвердження":
+        return await _back_to_confirm(update, context)
+    if text == "✏️ Змінити значення":
+        await update.message.reply_text("Надішліть нові значення, кожне з нового рядка:", reply_markup=ReplyKeyboardRemove())
+        return BATCH_VALUES
+    if text not in (BATCH_SEND, BATCH_SEND_EACH):
+        await update.message.reply_text("Будь ласка, оберіть дію зі списку.")
+        return BATCH_CONFIRM
+
+    chat_id = os.getenv("TARGET_CHAT_ID")
+    if not chat_id:
+        await update.message.reply_text(
+            "Не задано TARGET_CHAT_ID. Додайте змінну середовища.",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return ConversationHandler.END
+
+    count = len(context.user_data["batch_values"])
+    if not await _submit_batch(update, context, chat_id, individual=text == BATCH_SEND_EACH):
+        await update.message.reply_text("❌ Не вдалося надіслати пакет. Спробуйте ще раз.")
+        return BATCH_CONFIRM
+
+    await update.message.reply_text(
+        f"✅ Пакет із {count} заявок надіслано!",
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton(text="📝 Нова заявка")]], resize_keyboard=True),
+    )
+    context.user_data.clear()
+    return ConversationHandler.END
+
+
 async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = (update.message.text or "").strip()
 
+    if text == BATCH_BUTTON:
+        return await show_batch_fields(update, context)
+
     # Швидка заявка - "Додати деталі"
     if text == "✏️ Додати деталі":
         context.user_data["quick_mode"] = False  # Виходимо зі швидкого режиму
@@ -1437,19 +1809,9 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return ConversationHandler.END
 
-        application_text = _format_application(context.user_data)
-        thread_id = context.user_data.get("thread_id")
-        
-        # Додаємо згадку користувача
-        user = update.effective_user
-        user_mention = f"@{user.username}" if user.username else user.full_name
-        notification = f"📋 {user_mention} створив нову заявку:\n\n{application_text}"
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=notification,
-            message_thread_id=thread_id,
-        )
+        if not await _submit_application(update, context, chat_id):
+            await update.message.reply_text("❌ Не вдалося надіслати заявку. Спробуйте ще раз.")
+            return CONFIRM
         
         # Повернення до стартового меню
         keyboard = ReplyKeyboardMarkup(
@@ -1481,17 +1843,9 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return ConversationHandler.END
 
-        application_text = _format_application(context.user_data)
-        
-        # Додаємо згадку користувача
-        user = update.effective_user
-        user_mention = f"@{user.username}" if user.username else user.full_name
-        notification = f"📋 {user_mention} створив нову заявку:\n\n{application_text}"
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=notification,
-        )
+        if not await _submit_application(update, context, chat_id):
+            await update.message.reply_text("❌ Не вдалося надіслати заявку. Спробуйте ще раз.")
+            return CONFIRM
         
         # Запропонувати зберегти як шаблон (для всіх типів заявок)
         keyboard = ReplyKeyboardMarkup(
@@ -1545,15 +1899,9 @@ async def handle_save_template_name(update: Update, context: ContextTypes.DEFAUL
     user_id = update.effective_user.id
     
     # Зберегти шаблон (лише стабільні поля)
-    allowed_keys = {q["key"] for q in QUESTIONS} | {
-        "department",
-        "thread_id",
-        "quick_mode",
-        "date_type",
-    }
-    template_data = {k: v for k, v in context.user_data.items() if k in allowed_keys}
+    template_data = {k: v for k, v in context.user_data.items() if k in APPLICATION_KEYS}
     
-    success = db.save_template(user_id, template_name, template_data)
+    success = await db.save_template(user_id, template_name, template_data)
     
     if success:
         keyboard = ReplyKeyboardMarkup(
@@ -1624,31 +1972,315 @@ async def request_button(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logging.warning(f"Не вдалося закріпити повідомлення: {e}")
 
 
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Вивантажити заявки за місяць: /export [РРРР-ММ] [csv|xlsx]"""
+    if update.effective_user.id not in EXPORT_USER_IDS:
+        await update.message.reply_text("Немає доступу до вивантаження заявок.")
+        return
+
+    month = export.previous_month()
+    fmt = "xlsx"
+    for arg in context.args or []:
+        if arg.lower() in export.EXPORT_FORMATS:
+            fmt = arg.lower()
+        else:
+            month = arg
+    try:
+        export.month_range(month)
+    except ValueError:
+        await update.message.reply_text("Формат: /export РРРР-ММ csv|xlsx, наприклад /export 2025-01 xlsx")
+        return
+
+    await update.message.reply_text(f"⏳ Формую вивантаження за {month}...")
+    chat_id = update.effective_chat.id
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        # Запис файлу блокуючий - в окремому потоці, щоб не зупиняти обробку оновлень
+        count = await asyncio.to_thread(export.export_applications, path, fmt, month)
+        if not count:
+            await update.message.reply_text(f"За {month} заявок немає.")
+            return
+
+        async def send_document():
+            # Файл відкривається при кожній спробі планувальника
+            with open(path, "rb") as document:
+                return await context.bot.send_document(
+                    chat_id=chat_id,
+                    document=document,
+                    filename=f"applications_{month}.{fmt}",
+                    caption=f"Заявки за {month}: {count}",
+                )
+
+        await messaging.get_scheduler(context.bot).submit(chat_id, send_document)
+    except Exception as e:
+        logging.error(f"Помилка при вивантаженні заявок: {e}")
+        await update.message.reply_text("❌ Не вдалося сформувати вивантаження.")
+    finally:
+        os.remove(path)
+
+
+async def export_templates_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Надіслати шаблони користувача JSON-файлом"""
+    templates = await db.get_user_templates_with_data(update.effective_user.id)
+    if not templates:
+        await update.message.reply_text("У вас ще немає збережених шаблонів.")
+        return
+    content = json.dumps({"version": 1, "templates": templates}, ensure_ascii=False, indent=2, default=str)
+    await update.message.reply_document(
+        document=content.encode("utf-8"),
+        filename="templates.json",
+        caption=f"Шаблонів: {len(templates)}. Файл можна імпортувати командою /import_templates",
+    )
+
+
+async def import_templates_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Попросити JSON-файл з шаблонами (формат як у /export_templates)"""
+    context.user_data["awaiting_templates_import"] = True
+    await update.message.reply_text("Надішліть JSON-файл з шаблонами (отриманий через /export_templates).")
+
+
+def _parse_templates_file(raw: bytes) -> List[Dict[str, Any]]:
+    """Розібрати файл імпорту; у даних лишаються тільки поля заявки"""
+    content = json.loads(raw.decode("utf-8-sig"))
+    items = content.get("templates") if isinstance(content, dict) else content
+    if not isinstance(items, list):
+        raise ValueError("очікується список шаблонів")
+    if len(items) > TEMPLATE_IMPORT_MAX_COUNT:
+        raise ValueError(f"забагато шаблонів (максимум {TEMPLATE_IMPORT_MAX_COUNT})")
+
+    templates = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("data"), dict):
+            raise ValueError("кожен шаблон має містити name та data")
+        name = str(item.get("name") or "").strip()[:100]
+        if not name:
+            raise ValueError("шаблон без назви")
+        data = {
+            k: v for k, v in item["data"].items()
+            if k in APPLICATION_KEYS and k != "thread_id" and isinstance(v, (str, int, float, bool))
+        }
+        # Гілку визначає лише підрозділ: thread_id з файлу міг би вести в будь-яку тему групи
+        department = data.get("department")
+        if department is not None:
+            if department not in THREAD_IDS:
+                raise ValueError(f"невідомий підрозділ '{department}' у шаблоні '{name}'")
+            data["thread_id"] = THREAD_IDS[department]
+        templates.append({"name": name, "data": data})
+    return templates
+
+
+async def handle_templates_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Імпорт шаблонів з JSON-файлу одним пакетним записом"""
+    caption = (update.message.caption or "").strip()
+    if not context.user_data.pop("awaiting_templates_import", False) and not caption.startswith("/import_templates"):
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > TEMPLATE_IMPORT_MAX_BYTES:
+        await update.message.reply_text("Файл завеликий (максимум 1 МБ).")
+        return
+    try:
+        telegram_file = await document.get_file()
+        templates = _parse_templates_file(bytes(await telegram_file.download_as_bytearray()))
+    except (ValueError, UnicodeDecodeError) as e:
+        await update.message.reply_text(f"❌ Не вдалося прочитати файл: {e}")
+        return
+    except TelegramError as e:
+        logging.error(f"Помилка при завантаженні файлу шаблонів: {e}")
+        await update.message.reply_text("❌ Не вдалося завантажити файл. Спробуйте ще раз.")
+        return
+
+    if not templates:
+        await update.message.reply_text("У файлі немає шаблонів.")
+        return
+    if await db.save_templates(update.effective_user.id, templates):
+        await update.message.reply_text(f"✅ Імпортовано шаблонів: {len(templates)}")
+    else:
+        await update.message.reply_text("❌ Помилка при збереженні шаблонів. Спробуйте ще раз.")
+
+
+async def inline_templates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Inline-режим: шаблони користувача, в назві яких є запит, з кнопкою надсилання"""
+    inline_query = update.inline_query
+    query = inline_query.query.strip() or None
+    # offset - id останнього показаного шаблону (keyset-сторінки при прокрутці)
+    after_id = int(inline_query.offset) if inline_query.offset.isdigit() else None
+    page = None
+    if db.DATABASE_URL:
+        # Дані шаблонів приходять тим самим запитом - один запит до БД на inline-запит
+        page = await db.list_templates_page(
+            inline_query.from_user.id, query, after_id, limit=INLINE_RESULTS_LIMIT, with_data=True
+        )
+    page = page or []
+    matched = page[:INLINE_RESULTS_LIMIT]
+    next_offset = str(matched[-1]["id"]) if len(page) > INLINE_RESULTS_LIMIT else ""
+
+    results = []
+    for template in matched:
+        data = template["data"]
+        results.append(
+            InlineQueryResultArticle(
+                id=str(template["id"]),
+                title=template["name"],
+                description=application_text.render_compact(data),
+                input_message_content=InputTextMessageContent(
+                    f"📋 Шаблон '{template['name']}'\n\n{_format_application(data)}"
+                ),
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton(
+                        text="📤 Надіслати заявку",
+                        callback_data=f"{TEMPLATE_CALLBACK_PREFIX}:S:{template['id']}",
+                    )
+                ]]),
+            )
+        )
+
+    # Шаблонів немає - запропонувати перейти до бота і створити заявку
+    button = None if results or after_id else InlineQueryResultsButton(text="📝 Створити заявку", start_parameter="apply")
+    await inline_query.answer(
+        results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset, button=button
+    )
+
+
+async def handle_template_send(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка "Надіслати заявку" під шаблоном, вставленим через inline-режим"""
+    query = update.callback_query
+    template = await db.get_template(int(query.data.rsplit(":", 1)[1]))
+    if template is None or template["user_id"] != query.from_user.id:
+        await query.answer("Надіслати заявку з шаблону може лише його власник.", show_alert=True)
+        return
+
+    data = {**template["data"], "thread_id": THREAD_IDS.get(template["data"].get("department"))}
+    if not data["thread_id"]:
+        await query.answer("У шаблоні не вказано, від кого запит. Завантажте його через /start.", show_alert=True)
+        return
+    chat_id = os.getenv("TARGET_CHAT_ID")
+    if not chat_id:
+        await query.answer("Не задано TARGET_CHAT_ID. Додайте змінну середовища.", show_alert=True)
+        return
+
+    # Одне вставлене повідомлення - одна заявка, навіть якщо кнопку натиснули двічі
+    key = f"inline:{query.inline_message_id or query.id}"
+    if not await _deliver_application(context, query.from_user, data, chat_id, key):
+        await query.answer("❌ Не вдалося надіслати заявку. Спробуйте ще раз.", show_alert=True)
+        return
+    _record_answers(context, query.from_user.id, data)
+
+    await query.answer("✅ Заявку надіслано!")
+    try:
+        await query.edit_message_text(f"✅ Заявку надіслано: {template['name']}\n\n{_format_application(data)}")
+    except TelegramError as e:
+        logging.warning(f"Не вдалося оновити повідомлення шаблону: {e}")
+
+
 async def handle_make_request_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обробка кнопки 📝 Зробити заявку поза ConversationHandler"""
     if update.message.text == "📝 Зробити заявку":
         await start(update, context)
 
 
+def _instrument_conversation(conv: ConversationHandler) -> None:
+    """Метрики для кожного обробника розмови: час, винятки та кількість розмов у станах"""
+    metrics.CONVERSATIONS.set_state_names(STATE_NAMES)
+    groups = [("ENTRY", conv.entry_points), ("FALLBACK", conv.fallbacks)]
+    groups += [(STATE_NAMES.get(state, str(state)), handlers) for state, handlers in conv.states.items()]
+    for state_name, handlers in groups:
+        for handler in handlers:
+            handler.callback = metrics.instrument_handler(handler.callback, state_name, metrics.CONVERSATIONS)
+
+
+def _register_stats_metrics(app: Application) -> None:
+    """Лічильники пулу БД, кешів, черг оновлень та вихідних викликів на /metrics"""
+    metrics.register_stats("bot_db_pool", db.get_pool_stats)
+    metrics.register_stats("bot_template_cache", lambda: db.get_cache_stats()["templates"])
+    metrics.register_stats("bot_template_list_cache", lambda: db.get_cache_stats()["template_lists"])
+    metrics.register_stats("bot_city_search", get_city_search_stats)
+    metrics.register_stats("bot_answer_cache", suggestions.cache_stats)
+    metrics.register_stats("bot_update_processor", getattr(app.update_processor, "stats", lambda: None))
+    metrics.register_stats("bot_outbound", messaging.scheduler_stats)
+    metrics.register_stats("bot_outbox", outbox.dispatcher_stats)
+
+
+async def post_init(application: Application) -> None:
+    """Підготовка спільних ресурсів після ініціалізації бота"""
+    client = await novaposhta.start_client()
+    settlements.start_refresh(client)
+    scheduler = messaging.start_scheduler(application.bot)
+    messaging.start_pipeline(application.bot)
+    if db.DATABASE_URL:
+        outbox.start_dispatcher(scheduler)
+    await metrics.start_server()
+
+
+async def post_stop(application: Application) -> None:
+    """Дочекатися фонових викликів Telegram, поки бот ще ініціалізований"""
+    await outbox.stop_dispatcher()
+    await messaging.stop_pipeline()
+    await messaging.stop_scheduler()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Звільнення ресурсів при зупинці бота"""
+    await settlements.stop_refresh()
+    await metrics.stop_server()
+    await novaposhta.close_client()
+    db.close_pool()
+
+
 def build_app() -> Application:
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
 
-    app = Application.builder().token(token).build()
-
-    # Ініціалізувати БД
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        api_url = TELEGRAM_API_URL.rstrip("/")
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    # Різні користувачі обробляються паралельно, оновлення одного - строго по черзі
+    if UPDATE_WORKERS > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_WORKERS))
+    # Стан незавершених заявок зберігається в БД і переживає перезапуск
+    use_persistence = bool(db.DATABASE_URL) and PERSISTENCE_ENABLED
+    if use_persistence:
+        builder = builder.persistence(DBPersistence())
+    app = builder.build()
+
+    # Ініціалізувати пул з'єднань та БД
+    db.init_pool()
     db.init_db()
+    _precompute_markups()
+
+    pasted_filter = (
+        filters.ChatType.PRIVATE
+        & filters.TEXT
+        & ~filters.COMMAND
+        & filters.Regex(re.compile(PASTED_APPLICATION_PATTERN))
+    )
+
+    def pasted_application() -> MessageHandler:
+        # Окремий обробник для кожного місця - метрики рахують вставку лише в її стані
+        return MessageHandler(pasted_filter, handle_pasted_application)
 
     conv = ConversationHandler(
         entry_points=[
             CommandHandler("start", start),
             MessageHandler(filters.Regex("^📝 (Зробити заявку|Нова заявка)$"), start),
+            pasted_application(),
         ],
         states={
-            START: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_start_menu_choice)],
-            LOAD_TEMPLATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_start_menu_choice)],
-            TEMPLATE_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_template_select)],
+            START: [pasted_application(), MessageHandler(filters.TEXT & ~filters.COMMAND, handle_start_menu_choice)],
+            LOAD_TEMPLATE: [pasted_application(), MessageHandler(filters.TEXT & ~filters.COMMAND, handle_start_menu_choice)],
+            TEMPLATE_SELECT: [
+                CallbackQueryHandler(handle_template_callback, pattern=rf"^{TEMPLATE_CALLBACK_PREFIX}:([LNB]:\d+|Q)$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_template_select),
+            ],
             DELETE_TEMPLATE_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_delete_template_confirm)],
             DEPARTMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_department)],
             QUESTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_answer)],
@@ -1665,18 +2297,45 @@ def build_app() -> Application:
             EDIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_edit_choice)],
             SAVE_TEMPLATE_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_save_template_response)],
             SAVE_TEMPLATE_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_save_template_name)],
+            BATCH_FIELD: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_batch_field)],
+            BATCH_VALUES: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_batch_values)],
+            BATCH_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_batch_confirm)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="application_form",
+        persistent=use_persistence,
     )
 
+    _instrument_conversation(conv)
+    _register_stats_metrics(app)
+
     app.add_handler(conv)
     app.add_handler(CommandHandler("request", request_button))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("export_templates", export_templates_command))
+    app.add_handler(CommandHandler("import_templates", import_templates_command))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("json"), handle_templates_file))
+    app.add_handler(InlineQueryHandler(inline_templates))
+    app.add_handler(CallbackQueryHandler(handle_template_send, pattern=rf"^{TEMPLATE_CALLBACK_PREFIX}:S:\d+$"))
+    app.add_handler(CallbackQueryHandler(handle_stale_template_button, pattern=rf"^{TEMPLATE_CALLBACK_PREFIX}:[LNBQ]"))
     return app
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Бот для формування заявок на перевезення")
+    parser.add_argument(
+        "--webhook",
+        action="store_true",
+        default=os.getenv("BOT_MODE", "polling").lower() == "webhook",
+        help="працювати через вебхук замість long polling (або BOT_MODE=webhook)",
+    )
+    args = parser.parse_args()
+
     app = build_app()
-    app.run_polling()
+    if args.webhook:
+        asyncio.run(webhook.serve(app))
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
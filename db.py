@@ -1,16 +1,109 @@
 import os
+import re
 import json
+import time
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterator
+from datetime import datetime, date
 import psycopg2
-from psycopg2.extras import RealDictCursor, Json
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from cache import TTLCache
+import metrics
 
 # Отримуємо DATABASE_URL з змінних середовища
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Налаштування пулу з'єднань.
+# psycopg2 закриває з'єднання понад DB_POOL_MIN_SIZE при поверненні в пул,
+# тому мінімум варто тримати близьким до типового навантаження.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "4"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "8"))
+# Скільки секунд чекати на вільне з'єднання
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Обмеження часу виконання одного запиту на стороні PostgreSQL
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+# Кеш шаблонів у пам'яті процесу (інвалідується при збереженні/видаленні)
+TEMPLATE_CACHE_TTL = float(os.getenv("TEMPLATE_CACHE_TTL", "300"))
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "1000"))
+
 logger = logging.getLogger(__name__)
 
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_slots: Optional[threading.BoundedSemaphore] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_stats_lock = threading.Lock()
+_pool_stats: Dict[str, float] = {
+    "acquired_total": 0,
+    "timeouts_total": 0,
+    "errors_total": 0,
+    "in_use": 0,
+    "max_in_use": 0,
+    "waiting": 0,
+    "pending_calls": 0,
+    "wait_seconds_total": 0.0,
+    "max_wait_seconds": 0.0,
+}
+
+# user_id -> список шаблонів користувача
+_template_list_cache = TTLCache(maxsize=TEMPLATE_CACHE_SIZE, ttl=TEMPLATE_CACHE_TTL)
+# template_id -> шаблон з даними
+_template_cache = TTLCache(maxsize=TEMPLATE_CACHE_SIZE, ttl=TEMPLATE_CACHE_TTL)
+# Покоління кешів: зростає при кожній інвалідації, тож результат запиту, що почався
+# до запису, не повертається в кеш застарілим. Один лічильник на кеш (а не на ключ),
+# щоб пам'ять не росла з кількістю користувачів; інвалідація іншого ключа лише
+# пропускає одне збереження в кеш.
+_cache_generations: Dict[int, int] = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_version(cache: TTLCache, key: Any) -> int:
+    return _cache_generations.get(id(cache), 0)
+
+
+def _invalidate(cache: TTLCache, key: Any) -> None:
+    """Прибрати ключ з кешу після успішного запису в БД"""
+    with _cache_lock:
+        _cache_generations[id(cache)] = _cache_generations.get(id(cache), 0) + 1
+        cache.pop(key)
+
+
+def _cache_if_current(cache: TTLCache, key: Any, value: Any, version: int) -> None:
+    """Зберегти результат запиту, лише якщо ключ не інвалідували, поки запит виконувався"""
+    with _cache_lock:
+        if _cache_version(cache, key) == version:
+            cache.set(key, value)
+
+
+# Види рядків applications: окрема заявка та зведення пакета (не входить в історію)
+APPLICATION_KIND = "application"
+BATCH_SUMMARY_KIND = "batch_summary"
+
+# Чи доступний pg_trgm (визначається в init_db)
+_trigram_search = False
+
+
+class PoolTimeoutError(RuntimeError):
+    """Не вдалося отримати з'єднання з пулу за DB_POOL_TIMEOUT"""
+
+
+def _json_dumps(value: Any) -> str:
+    # Дати та інші не-JSON значення зберігаємо рядком
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _connect_kwargs() -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {}
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        kwargs["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return kwargs
+
 
 def get_connection():
     """Отримати з'єднання з PostgreSQL"""
@@ -19,102 +112,415 @@ def get_connection():
         raise RuntimeError("DATABASE_URL environment variable is not set")
     
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = psycopg2.connect(DATABASE_URL, **_connect_kwargs())
         return conn
     except Exception as e:
         logger.error(f"Error connecting to database: {e}")
         raise
 
 
+def init_pool(
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+) -> None:
+    """Створити пул з'єднань (один раз при старті застосунку)"""
+    global _pool, _pool_slots, _executor
+    if _pool is not None:
+        return
+    if not DATABASE_URL:
+        logger.error("DATABASE_URL is not set, connection pool is disabled")
+        return
+
+    min_size = DB_POOL_MIN_SIZE if min_size is None else min_size
+    max_size = DB_POOL_MAX_SIZE if max_size is None else max_size
+    min_size = min(min_size, max_size)
+    try:
+        _pool = ThreadedConnectionPool(min_size, max_size, DATABASE_URL, **_connect_kwargs())
+    except Exception as e:
+        logger.error(f"Error creating connection pool: {e}")
+        return
+    _pool_slots = threading.BoundedSemaphore(max_size)
+    # Потоків рівно стільки, скільки з'єднань: зайві запити чекають у черзі
+    # виконавця, а не займають потік в очікуванні з'єднання
+    _executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix="db")
+    with _stats_lock:
+        _pool_stats["size_min"] = min_size
+        _pool_stats["size_max"] = max_size
+    logger.info(f"Database pool created (min={min_size}, max={max_size})")
+
+
+def close_pool() -> None:
+    """Закрити всі з'єднання пулу (при зупинці застосунку)"""
+    global _pool, _pool_slots, _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+        _pool_slots = None
+        logger.info("Database pool closed")
+
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Статистика кешів шаблонів"""
+    return {
+        "template_lists": _template_list_cache.stats(),
+        "templates": _template_cache.stats(),
+    }
+
+
+def get_pool_stats() -> Dict[str, float]:
+    """Знімок метрик використання пулу з'єднань"""
+    with _stats_lock:
+        return dict(_pool_stats)
+
+
+def _update_stats(**deltas: float) -> None:
+    with _stats_lock:
+        for key, delta in deltas.items():
+            _pool_stats[key] += delta
+        if _pool_stats["in_use"] > _pool_stats["max_in_use"]:
+            _pool_stats["max_in_use"] = _pool_stats["in_use"]
+
+
+@contextmanager
+def _connection():
+    """З'єднання з пулу (або окреме, якщо пул не створено)"""
+    if _pool is None:
+        conn = get_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    started = time.monotonic()
+    _update_stats(waiting=1)
+    acquired = _pool_slots.acquire(timeout=DB_POOL_TIMEOUT)
+    waited = time.monotonic() - started
+    _update_stats(waiting=-1, wait_seconds_total=waited)
+    with _stats_lock:
+        _pool_stats["max_wait_seconds"] = max(_pool_stats["max_wait_seconds"], waited)
+    if not acquired:
+        _update_stats(timeouts_total=1)
+        raise PoolTimeoutError(f"No free database connection after {DB_POOL_TIMEOUT}s")
+
+    try:
+        conn = _pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+    _update_stats(acquired_total=1, in_use=1)
+    try:
+        yield conn
+    except Exception:
+        _update_stats(errors_total=1)
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        _pool.putconn(conn, close=bool(conn.closed))
+        _update_stats(in_use=-1)
+        _pool_slots.release()
+
+
+def _db_error(function: str, message: str) -> None:
+    """Помилка, яку функція db.py перехопила сама: у лог і в bot_db_call_errors_total"""
+    metrics.DB_ERRORS.inc(function)
+    logger.error(message)
+
+
+def _run_in_thread(func):
+    """Зробити блокуючу функцію асинхронною: виконується в потоці пулу БД"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        _update_stats(pending_calls=1)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+        except Exception:
+            # Винятки, що вийшли з функції (перехоплені рахує _db_error)
+            metrics.DB_ERRORS.inc(func.__name__)
+            raise
+        finally:
+            _update_stats(pending_calls=-1)
+            metrics.DB_LATENCY.observe(time.perf_counter() - started, func.__name__)
+
+    # Синхронна версія для скриптів поза event loop
+    wrapper.sync = func
+    return wrapper
+
+
 def init_db():
     """Ініціалізація БД та таблиць"""
+    global _trigram_search
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Таблиця шаблонів
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS templates (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                template_name TEXT NOT NULL,
-                template_data JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Таблиця контактів
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS contacts (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                contact_type TEXT NOT NULL,
-                contact_value TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Індекси для швидкості
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_templates_user_id 
-            ON templates(user_id)
-        """)
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_contacts_user_id 
-            ON contacts(user_id)
-        """)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            # Таблиця шаблонів
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS templates (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    template_name TEXT NOT NULL,
+                    template_data JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Таблиця контактів
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS contacts (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    contact_type TEXT NOT NULL,
+                    contact_value TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Індекси для швидкості
+            # Сторінки шаблонів користувача (keyset за id); замінює індекс лише за user_id
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_templates_user_page
+                ON templates(user_id, id)
+            """)
+            cursor.execute("DROP INDEX IF EXISTS idx_templates_user_id")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_contacts_user_id 
+                ON contacts(user_id)
+            """)
+            
+            # Стан розмов та user_data (переживає перезапуски бота)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS bot_persistence (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    data JSONB NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (kind, key)
+                )
+            """)
+            
+            # Вихідна черга заявок: спершу запис тут, потім доставка в групу
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS applications (
+                    id BIGSERIAL PRIMARY KEY,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    user_id BIGINT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    thread_id INTEGER,
+                    payload JSONB NOT NULL,
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    last_error TEXT,
+                    message_id BIGINT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_due
+                ON applications(next_attempt_at)
+                WHERE status IN ('pending', 'sending')
+            """)
+            
+            # Типізовані поля заявки для пошуку по історії
+            cursor.execute("""
+                ALTER TABLE applications
+                    ADD COLUMN IF NOT EXISTS department TEXT,
+                    ADD COLUMN IF NOT EXISTS cargo_type TEXT,
+                    ADD COLUMN IF NOT EXISTS load_city TEXT,
+                    ADD COLUMN IF NOT EXISTS unload_city TEXT,
+                    ADD COLUMN IF NOT EXISTS date_from DATE,
+                    ADD COLUMN IF NOT EXISTS date_to DATE
+            """)
+            # kind: application - одна заявка, batch_summary - зведення пакета (лише доставка,
+            # в історію та експорт не потрапляє)
+            cursor.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'applications' AND column_name = 'kind'
+            """)
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    ALTER TABLE applications
+                        ADD COLUMN kind TEXT NOT NULL DEFAULT 'application'
+                """)
+                cursor.execute("""
+                    UPDATE applications SET kind = 'batch_summary'
+                    WHERE payload ? 'batch_field'
+                """)
+            # Усі індекси закінчуються на id: фільтр + сортування для keyset-пагінації
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_department
+                ON applications(department, id)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_user
+                ON applications(user_id, id)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_cargo
+                ON applications(lower(cargo_type), id)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_route
+                ON applications(lower(load_city), lower(unload_city), id)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_unload_city
+                ON applications(lower(unload_city), id)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_dates
+                ON applications(date_from, date_to)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_applications_payload
+                ON applications USING GIN (payload jsonb_path_ops)
+            """)
+            
+            # Частота відповідей: user_id = 0 - підсумок по підрозділу
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS answer_stats (
+                    user_id BIGINT NOT NULL,
+                    department TEXT NOT NULL DEFAULT '',
+                    field TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    uses INTEGER NOT NULL DEFAULT 1,
+                    last_used_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, department, field, value)
+                )
+            """)
+            
+            # Нечіткий пошук шаблонів за назвою; pg_trgm може бути недоступне без прав
+            cursor.execute("SAVEPOINT trigram")
+            try:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_templates_name_trgm
+                    ON templates USING GIN (template_name gin_trgm_ops)
+                """)
+                cursor.execute("RELEASE SAVEPOINT trigram")
+                _trigram_search = True
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT trigram")
+                _trigram_search = False
+                logger.warning(f"pg_trgm is unavailable, template search falls back to ILIKE: {e}")
+            
+            conn.commit()
+            cursor.close()
         logger.info("Database initialized successfully")
     except Exception as e:
-        logger.error(f"Error initializing database: {e}")
+        _db_error("init_db", f"Error initializing database: {e}")
 
 
+@_run_in_thread
 def save_template(user_id: int, template_name: str, template_data: Dict[str, Any]) -> bool:
     """Зберегти шаблон заявки"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            """
-            INSERT INTO templates (user_id, template_name, template_data)
-            VALUES (%s, %s, %s)
-            """,
-            (user_id, template_name, Json(template_data))
-        )
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                """
+                INSERT INTO templates (user_id, template_name, template_data)
+                VALUES (%s, %s, %s)
+                """,
+                (user_id, template_name, Json(template_data))
+            )
+            
+            conn.commit()
+            cursor.close()
+        _invalidate(_template_list_cache, user_id)
         logger.info(f"Template '{template_name}' saved for user {user_id}")
         return True
     except Exception as e:
-        logger.error(f"Error saving template: {e}")
+        _db_error("save_template", f"Error saving template: {e}")
         return False
 
 
-def get_user_templates(user_id: int) -> List[Dict[str, Any]]:
-    """Отримати всі шаблони користувача"""
+@_run_in_thread
+def save_templates(user_id: int, templates: List[Dict[str, Any]]) -> bool:
+    """Зберегти багато шаблонів одним запитом: templates - [{"name": ..., "data": {...}}]"""
+    if not templates:
+        return True
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute(
-            """
-            SELECT id, template_name, created_at
-            FROM templates
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            """,
-            (user_id,)
-        )
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            execute_values(
+                cursor,
+                "INSERT INTO templates (user_id, template_name, template_data) VALUES %s",
+                [(user_id, t["name"], Json(t["data"], dumps=_json_dumps)) for t in templates],
+                page_size=1000,
+            )
+            
+            conn.commit()
+            cursor.close()
+        _invalidate(_template_list_cache, user_id)
+        logger.info(f"{len(templates)} templates saved for user {user_id}")
+        return True
+    except Exception as e:
+        _db_error("save_templates", f"Error saving templates: {e}")
+        return False
+
+
+@_run_in_thread
+def get_user_templates_with_data(user_id: int) -> List[Dict[str, Any]]:
+    """Усі шаблони користувача разом з даними (для експорту), від старіших до новіших"""
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                """
+                SELECT template_name, template_data
+                FROM templates
+                WHERE user_id = %s
+                ORDER BY created_at, id
+                """,
+                (user_id,)
+            )
+            
+            templates = cursor.fetchall()
+            cursor.close()
         
-        templates = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        return [
+            {
+                "name": t["template_name"],
+                "data": json.loads(t["template_data"]) if isinstance(t["template_data"], str) else t["template_data"],
+            }
+            for t in templates
+        ]
+    except Exception as e:
+        _db_error("get_user_templates_with_data", f"Error fetching templates with data: {e}")
+        return []
+
+
+@_run_in_thread
+def _fetch_user_templates(user_id: int) -> Optional[List[Dict[str, Any]]]:
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                """
+                SELECT id, template_name, created_at
+                FROM templates
+                WHERE user_id = %s
+                ORDER BY created_at DESC
+                """,
+                (user_id,)
+            )
+            
+            templates = cursor.fetchall()
+            cursor.close()
 
         return [
             {
@@ -125,117 +531,672 @@ def get_user_templates(user_id: int) -> List[Dict[str, Any]]:
             for t in templates
         ]
     except Exception as e:
-        logger.error(f"Error fetching templates: {e}")
-        return []
+        _db_error("_fetch_user_templates", f"Error fetching templates: {e}")
+        return None
 
 
-def get_template(template_id: int) -> Optional[Dict[str, Any]]:
-    """Отримати конкретний шаблон"""
+async def get_user_templates(user_id: int) -> List[Dict[str, Any]]:
+    """Отримати всі шаблони користувача"""
+    # Перевіряємо кеш до передачі в потік, щоб влучання не чекало на пул
+    templates = _template_list_cache.get(user_id)
+    if templates is None:
+        version = _cache_version(_template_list_cache, user_id)
+        templates = await _fetch_user_templates(user_id)
+        if templates is None:
+            return []
+        _cache_if_current(_template_list_cache, user_id, templates, version)
+    return list(templates)
+
+
+@_run_in_thread
+def list_templates_page(
+    user_id: int,
+    query: Optional[str] = None,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = 8,
+    with_data: bool = False,
+) -> Optional[List[Dict[str, Any]]]:
+    """Сторінка шаблонів користувача, від новіших до старіших (keyset за id).
+
+    after_id - наступна сторінка (шаблони, старші за after_id), before_id - попередня.
+    query - нечіткий пошук за назвою (підрядок або схожість за триграмами).
+    with_data - додати дані шаблонів ("data") тим самим запитом.
+    Повертає до limit + 1 рядків: зайвий (найдальший від курсора) означає, що в цьому
+    напрямку є ще сторінка.
+    """
+    conditions = ["user_id = %s"]
+    params: List[Any] = [user_id]
+    if query:
+        if _trigram_search:
+            conditions.append("(template_name ILIKE %s OR %s <%% template_name)")
+            params += [f"%{_escape_like(query)}%", query]
+        else:
+            conditions.append("template_name ILIKE %s")
+            params.append(f"%{_escape_like(query)}%")
+    if after_id is not None:
+        conditions.append("id < %s")
+        params.append(after_id)
+    if before_id is not None:
+        conditions.append("id > %s")
+        params.append(before_id)
+    # Для попередньої сторінки йдемо від before_id вгору і розвертаємо результат
+    order = "ASC" if before_id is not None else "DESC"
+    params.append(limit + 1)
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute(
-            """
-            SELECT id, template_name, template_data
-            FROM templates
-            WHERE id = %s
-            """,
-            (template_id,)
-        )
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                f"""
+                SELECT id, template_name{', template_data' if with_data else ''}
+                FROM templates
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id {order}
+                LIMIT %s
+                """,
+                params
+            )
+            
+            rows = cursor.fetchall()
+            cursor.close()
         
-        template = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        if before_id is not None:
+            rows.reverse()
+        page = [{"id": row["id"], "name": row["template_name"]} for row in rows]
+        if with_data:
+            for template, row in zip(page, rows):
+                data = row["template_data"]
+                template["data"] = json.loads(data) if isinstance(data, str) else data
+        return page
+    except Exception as e:
+        _db_error("list_templates_page", f"Error fetching templates page: {e}")
+        return None
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+@_run_in_thread
+def _fetch_template(template_id: int) -> Optional[Dict[str, Any]]:
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                """
+                SELECT id, user_id, template_name, template_data
+                FROM templates
+                WHERE id = %s
+                """,
+                (template_id,)
+            )
+            
+            template = cursor.fetchone()
+            cursor.close()
         
         if template:
             raw_data = template["template_data"]
             data = json.loads(raw_data) if isinstance(raw_data, str) else raw_data
             return {
                 "id": template["id"],
+                "user_id": template["user_id"],
                 "name": template["template_name"],
                 "data": data,
             }
         return None
     except Exception as e:
-        logger.error(f"Error fetching template: {e}")
+        _db_error("_fetch_template", f"Error fetching template: {e}")
         return None
 
 
+async def get_template(template_id: int) -> Optional[Dict[str, Any]]:
+    """Отримати конкретний шаблон"""
+    template = _template_cache.get(template_id)
+    if template is None:
+        version = _cache_version(_template_cache, template_id)
+        template = await _fetch_template(template_id)
+        if template is None:
+            return None
+        _cache_if_current(_template_cache, template_id, template, version)
+    # Копія даних, щоб зміни у викликача не псували кеш
+    return {**template, "data": dict(template["data"])}
+
+
+@_run_in_thread
 def delete_template(template_id: int) -> bool:
     """Видалити шаблон"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "DELETE FROM templates WHERE id = %s",
-            (template_id,)
-        )
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "DELETE FROM templates WHERE id = %s RETURNING user_id",
+                (template_id,)
+            )
+            deleted = cursor.fetchone()
+            
+            conn.commit()
+            cursor.close()
+        _invalidate(_template_cache, template_id)
+        if deleted:
+            _invalidate(_template_list_cache, deleted[0])
         logger.info(f"Template {template_id} deleted")
         return True
     except Exception as e:
-        logger.error(f"Error deleting template: {e}")
+        _db_error("delete_template", f"Error deleting template: {e}")
         return False
 
 
+@_run_in_thread
 def save_contacts(user_id: int, contacts: List[Dict[str, str]]) -> bool:
     """Зберегти контакти користувача"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            # Видалити старі контакти
+            cursor.execute("DELETE FROM contacts WHERE user_id = %s", (user_id,))
+            
+            # Додати нові одним запитом
+            if contacts:
+                execute_values(
+                    cursor,
+                    "INSERT INTO contacts (user_id, contact_type, contact_value) VALUES %s",
+                    [(user_id, c.get("type", "general"), c.get("value", "")) for c in contacts],
+                )
+            
+            conn.commit()
+            cursor.close()
+        logger.info(f"Contacts saved for user {user_id}")
+        return True
+    except Exception as e:
+        _db_error("save_contacts", f"Error saving contacts: {e}")
+        return False
+
+
+@_run_in_thread
+def get_user_contacts(user_id: int) -> List[Dict[str, str]]:
+    """Отримати контакти користувача"""
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                """
+                SELECT contact_type, contact_value
+                FROM contacts
+                WHERE user_id = %s
+                ORDER BY created_at DESC
+                """,
+                (user_id,)
+            )
+            
+            contacts = cursor.fetchall()
+            cursor.close()
         
-        # Видалити старі контакти
-        cursor.execute("DELETE FROM contacts WHERE user_id = %s", (user_id,))
+        return [
+            {"type": c["contact_type"], "value": c["contact_value"]}
+            for c in contacts
+        ]
+    except Exception as e:
+        _db_error("get_user_contacts", f"Error fetching contacts: {e}")
+        return []
+
+
+@_run_in_thread
+def load_persistence(kind: str) -> Dict[str, Any]:
+    """Завантажити збережені дані певного типу (user_data, стан розмови)"""
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "SELECT key, data FROM bot_persistence WHERE kind = %s",
+                (kind,)
+            )
+            
+            rows = cursor.fetchall()
+            cursor.close()
         
-        # Додати нові
-        for contact in contacts:
+        return {key: json.loads(data) if isinstance(data, str) else data for key, data in rows}
+    except Exception as e:
+        _db_error("load_persistence", f"Error loading persistence '{kind}': {e}")
+        return {}
+
+
+@_run_in_thread
+def save_persistence_batch(upserts: List[tuple], deletes: List[tuple]) -> bool:
+    """Записати пакет змін однією транзакцією: upserts - (kind, key, data), deletes - (kind, key)"""
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            if upserts:
+                execute_values(
+                    cursor,
+                    """
+                    INSERT INTO bot_persistence (kind, key, data)
+                    VALUES %s
+                    ON CONFLICT (kind, key)
+                    DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+                    """,
+                    [(kind, key, Json(data, dumps=_json_dumps)) for kind, key, data in upserts],
+                )
+            if deletes:
+                execute_values(
+                    cursor,
+                    "DELETE FROM bot_persistence WHERE (kind, key) IN (VALUES %s)",
+                    deletes,
+                )
+            
+            conn.commit()
+            cursor.close()
+        return True
+    except Exception as e:
+        _db_error("save_persistence_batch", f"Error saving persistence batch: {e}")
+        return False
+
+
+_DATE_RE = re.compile(r"\b(\d{2}\.\d{2}\.\d{4})\b")
+# Поля, що дублюються з payload у типізовані колонки
+_APPLICATION_TEXT_COLUMNS = ("department", "cargo_type", "load_city", "unload_city")
+
+
+def _parse_date(value: str) -> Optional[date]:
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def _application_columns(payload: Dict[str, Any]) -> tuple:
+    """Значення типізованих колонок: текстові поля та період перевезення (дата або "дд.мм.рррр - дд.мм.рррр")"""
+    texts = []
+    for key in _APPLICATION_TEXT_COLUMNS:
+        value = payload.get(key)
+        texts.append(str(value).strip() if value and value != "—" else None)
+    dates = _DATE_RE.findall(str(payload.get("date_period") or ""))
+    date_from = _parse_date(dates[0]) if dates else None
+    date_to = _parse_date(dates[-1]) if dates else None
+    return (*texts, date_from, date_to)
+
+
+@_run_in_thread
+def enqueue_application(
+    idempotency_key: str,
+    user_id: int,
+    chat_id: str,
+    thread_id: Optional[int],
+    payload: Dict[str, Any],
+    text: str,
+) -> Optional[int]:
+    """Записати заявку у вихідну чергу; повторний виклик з тим самим ключем повертає той самий id"""
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
             cursor.execute(
                 """
-                INSERT INTO contacts (user_id, contact_type, contact_value)
-                VALUES (%s, %s, %s)
+                INSERT INTO applications (
+                    idempotency_key, user_id, chat_id, thread_id, payload, text,
+                    department, cargo_type, load_city, unload_city, date_from, date_to
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (idempotency_key) DO NOTHING
+                RETURNING id
                 """,
-                (user_id, contact.get("type", "general"), contact.get("value", ""))
+                (
+                    idempotency_key, user_id, str(chat_id), thread_id, Json(payload, dumps=_json_dumps), text,
+                    *_application_columns(payload),
+                )
             )
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        logger.info(f"Contacts saved for user {user_id}")
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(
+                    "SELECT id FROM applications WHERE idempotency_key = %s",
+                    (idempotency_key,)
+                )
+                row = cursor.fetchone()
+            
+            conn.commit()
+            cursor.close()
+        return row[0]
+    except Exception as e:
+        _db_error("enqueue_application", f"Error enqueuing application: {e}")
+        return None
+
+
+@_run_in_thread
+def enqueue_applications(user_id: int, chat_id: str, items: List[tuple]) -> bool:
+    """Записати пакет заявок у вихідну чергу одним запитом.
+
+    items - [(idempotency_key, thread_id, payload, text, kind, status)]: kind - APPLICATION_KIND
+    або BATCH_SUMMARY_KIND, status 'pending' - надіслати, 'batched' - лише для історії
+    (заявка вже є у зведенні). Вже записані ключі пропускаються, тож повторне
+    підтвердження пакета не дублює повідомлення.
+    """
+    if not items:
+        return True
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            execute_values(
+                cursor,
+                """
+                INSERT INTO applications (
+                    idempotency_key, user_id, chat_id, thread_id, payload, text, kind, status,
+                    department, cargo_type, load_city, unload_city, date_from, date_to
+                )
+                VALUES %s
+                ON CONFLICT (idempotency_key) DO NOTHING
+                """,
+                [
+                    (
+                        key, user_id, str(chat_id), thread_id, Json(payload, dumps=_json_dumps), text, kind, status,
+                        *_application_columns(payload),
+                    )
+                    for key, thread_id, payload, text, kind, status in items
+                ],
+            )
+            
+            conn.commit()
+            cursor.close()
+        logger.info(f"{len(items)} applications enqueued for user {user_id}")
         return True
     except Exception as e:
-        logger.error(f"Error saving contacts: {e}")
+        _db_error("enqueue_applications", f"Error enqueuing applications: {e}")
         return False
 
 
-def get_user_contacts(user_id: int) -> List[Dict[str, str]]:
-    """Отримати контакти користувача"""
+@_run_in_thread
+def claim_applications(limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+    """Взяти заявки, готові до надсилання (інші екземпляри бота їх пропускають).
+
+    Заявка отримує статус sending на lease_seconds: якщо процес впаде до
+    підтвердження, після закінчення оренди її візьме наступний прохід.
+    """
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute(
-            """
-            SELECT contact_type, contact_value
-            FROM contacts
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            """,
-            (user_id,)
-        )
-        
-        contacts = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                """
+                UPDATE applications
+                SET status = 'sending',
+                    attempts = attempts + 1,
+                    next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id FROM applications
+                    WHERE status IN ('pending', 'sending') AND next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, idempotency_key, user_id, chat_id, thread_id, text, attempts
+                """,
+                (lease_seconds, limit)
+            )
+            rows = cursor.fetchall()
+            
+            conn.commit()
+            cursor.close()
+        return sorted((dict(row) for row in rows), key=lambda row: row["id"])
+    except Exception as e:
+        _db_error("claim_applications", f"Error claiming applications: {e}")
+        return []
+
+
+@_run_in_thread
+def complete_applications(sent: List[tuple], failed: List[tuple]) -> bool:
+    """Записати результати доставки: sent - (id, message_id), failed - (id, помилка, затримка сек або None)
+
+    Затримка None означає, що спроби вичерпано і заявка більше не надсилається.
+    """
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            if sent:
+                execute_values(
+                    cursor,
+                    """
+                    UPDATE applications AS a
+                    SET status = 'sent', message_id = v.message_id, sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    FROM (VALUES %s) AS v (id, message_id)
+                    WHERE a.id = v.id
+                    """,
+                    sent,
+                    template="(%s::bigint, %s::bigint)",
+                )
+            if failed:
+                execute_values(
+                    cursor,
+                    """
+                    UPDATE applications AS a
+                    SET status = CASE WHEN v.delay IS NULL THEN 'failed' ELSE 'pending' END,
+                        last_error = v.error,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => COALESCE(v.delay, 0))
+                    FROM (VALUES %s) AS v (id, error, delay)
+                    WHERE a.id = v.id
+                    """,
+                    failed,
+                    template="(%s::bigint, %s::text, %s::double precision)",
+                )
+            
+            conn.commit()
+            cursor.close()
+        return True
+    except Exception as e:
+        _db_error("complete_applications", f"Error completing applications: {e}")
+        return False
+
+
+@_run_in_thread
+def query_applications(
+    department: Optional[str] = None,
+    cargo_type: Optional[str] = None,
+    load_city: Optional[str] = None,
+    unload_city: Optional[str] = None,
+    user_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    status: Optional[str] = None,
+    contains: Optional[Dict[str, Any]] = None,
+    before_id: Optional[int] = None,
+    limit: int = 50,
+) -> List[Dict[str, Any]]:
+    """Історія заявок, від новіших до старіших.
+
+    Наступна сторінка - before_id = id останньої заявки попередньої сторінки.
+    Міста та вид вантажу порівнюються без урахування регістру; date_from/date_to
+    відбирають заявки, період яких перетинається з заданим; contains - фільтр
+    за полями payload (JSONB @>).
+    """
+    conditions = ["kind = %s"]
+    params: List[Any] = [APPLICATION_KIND]
+    if department:
+        conditions.append("department = %s")
+        params.append(department)
+    if cargo_type:
+        conditions.append("lower(cargo_type) = lower(%s)")
+        params.append(cargo_type)
+    if load_city:
+        conditions.append("lower(load_city) = lower(%s)")
+        params.append(load_city)
+    if unload_city:
+        conditions.append("lower(unload_city) = lower(%s)")
+        params.append(unload_city)
+    if user_id is not None:
+        conditions.append("user_id = %s")
+        params.append(user_id)
+    if date_from is not None:
+        conditions.append("date_to >= %s")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("date_from <= %s")
+        params.append(date_to)
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if contains:
+        conditions.append("payload @> %s")
+        params.append(Json(contains, dumps=_json_dumps))
+    if before_id is not None:
+        conditions.append("id < %s")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(conditions)}"
+    params.append(limit)
+
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                f"""
+                SELECT id, user_id, department, cargo_type, load_city, unload_city,
+                       date_from, date_to, status, created_at, sent_at, payload
+                FROM applications
+                {where}
+                ORDER BY id DESC
+                LIMIT %s
+                """,
+                params
+            )
+            
+            rows = cursor.fetchall()
+            cursor.close()
         
         return [
-            {"type": c["contact_type"], "value": c["contact_value"]}
-            for c in contacts
+            {**{k: v for k, v in row.items() if k != "payload"}, "data": row["payload"]}
+            for row in rows
         ]
     except Exception as e:
-        logger.error(f"Error fetching contacts: {e}")
+        _db_error("query_applications", f"Error querying applications: {e}")
         return []
+
+
+def iter_applications(
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    department: Optional[str] = None,
+    batch_size: int = 2000,
+) -> Iterator[Dict[str, Any]]:
+    """Потоково перебрати заявки за період створення [created_from, created_to) у порядку id.
+
+    Використовує серверний курсор: у пам'яті одночасно лише batch_size рядків.
+    Синхронний генератор - викликати з окремого потоку, не з event loop.
+    """
+    conditions = ["kind = %s"]
+    params: List[Any] = [APPLICATION_KIND]
+    if created_from is not None:
+        conditions.append("created_at >= %s")
+        params.append(created_from)
+    if created_to is not None:
+        conditions.append("created_at < %s")
+        params.append(created_to)
+    if department:
+        conditions.append("department = %s")
+        params.append(department)
+    where = f"WHERE {' AND '.join(conditions)}"
+
+    with _connection() as conn:
+        # Іменований курсор живе на сервері; рядки приходять пачками по itersize
+        cursor = conn.cursor(name="applications_export", cursor_factory=RealDictCursor)
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(
+                f"""
+                SELECT id, created_at, sent_at, status, user_id, department, payload
+                FROM applications
+                {where}
+                ORDER BY id
+                """,
+                params
+            )
+            for row in cursor:
+                yield row
+        finally:
+            if not conn.closed:
+                cursor.close()
+                conn.rollback()
+
+
+# user_id у answer_stats для підсумку по всьому підрозділу
+DEPARTMENT_STATS_USER_ID = 0
+
+
+@_run_in_thread
+def record_answers(user_id: int, department: Optional[str], answers: Dict[str, str]) -> bool:
+    """Врахувати відповіді надісланої заявки у статистиці користувача та підрозділу"""
+    if not answers:
+        return True
+    rows = [
+        (owner, department or "", field, value)
+        for owner in (user_id, DEPARTMENT_STATS_USER_ID)
+        for field, value in sorted(answers.items())
+    ]
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            execute_values(
+                cursor,
+                """
+                INSERT INTO answer_stats (user_id, department, field, value) VALUES %s
+                ON CONFLICT (user_id, department, field, value) DO UPDATE
+                SET uses = answer_stats.uses + 1, last_used_at = CURRENT_TIMESTAMP
+                """,
+                rows,
+            )
+            
+            conn.commit()
+            cursor.close()
+        return True
+    except Exception as e:
+        _db_error("record_answers", f"Error recording answers: {e}")
+        return False
+
+
+@_run_in_thread
+def get_answer_stats(user_id: int, department: Optional[str], per_field: int = 10) -> Optional[List[Dict[str, Any]]]:
+    """Найчастіші відповіді користувача та його підрозділу (по per_field на поле); None при помилці"""
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(
+                """
+                SELECT user_id, field, value, uses, age_seconds
+                FROM (
+                    SELECT user_id, field, value, uses,
+                           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - last_used_at)) AS age_seconds,
+                           row_number() OVER (
+                               PARTITION BY user_id, field ORDER BY uses DESC, last_used_at DESC
+                           ) AS rank
+                    FROM answer_stats
+                    WHERE user_id IN (%s, %s) AND department = %s
+                ) ranked
+                WHERE rank <= %s
+                """,
+                (user_id, DEPARTMENT_STATS_USER_ID, department or "", per_field)
+            )
+            
+            rows = cursor.fetchall()
+            cursor.close()
+        
+        return [
+            {
+                "personal": row["user_id"] != DEPARTMENT_STATS_USER_ID,
+                "field": row["field"],
+                "value": row["value"],
+                "uses": row["uses"],
+                "age_seconds": float(row["age_seconds"] or 0),
+            }
+            for row in rows
+        ]
+    except Exception as e:
+        _db_error("get_answer_stats", f"Error fetching answer stats: {e}")
+        return None
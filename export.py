@@ -0,0 +1,131 @@
+import csv
+import argparse
+import logging
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import db
+
+EXPORT_FORMATS = ("csv", "xlsx")
+
+logger = logging.getLogger(__name__)
+
+
+def _payload(key: str) -> Callable[[Dict[str, Any]], Any]:
+    return lambda row: (row["payload"] or {}).get(key) or ""
+
+
+def _timestamp(key: str) -> Callable[[Dict[str, Any]], Any]:
+    return lambda row: row[key].strftime("%d.%m.%Y %H:%M") if row[key] else ""
+
+
+# Службові колонки, далі поля заявки в порядку повідомлення в групі
+EXPORT_COLUMNS: List[Tuple[str, Callable[[Dict[str, Any]], Any]]] = [
+    ("№", lambda row: row["id"]),
+    ("Створено", _timestamp("created_at")),
+    ("Надіслано", _timestamp("sent_at")),
+    ("Статус", lambda row: row["status"]),
+    ("ID користувача", lambda row: row["user_id"]),
+    ("Запит від", lambda row: row["department"] or _payload("department")(row)),
+    ("Тип авто", _payload("vehicle_type")),
+    ("ПІБ ініціатора", _payload("initiator")),
+    ("Підприємство", _payload("company")),
+    ("Вид вантажу", _payload("cargo_type")),
+    ("Габарит / негабарит", _payload("size_type")),
+    ("Обсяг", _payload("volume")),
+    ("Примітки", _payload("notes")),
+    ("Дата / період перевезення", _payload("date_period")),
+    ("Населений пункт завантаження", _payload("load_city")),
+    ("Склад завантаження", _payload("load_place")),
+    ("Спосіб завантаження", _payload("load_method")),
+    ("Контакт на завантаженні", _payload("load_contact")),
+    ("Населений пункт розвантаження", _payload("unload_city")),
+    ("Склад розвантаження", _payload("unload_place")),
+    ("Спосіб розвантаження", _payload("unload_method")),
+    ("Контакт на розвантаженні", _payload("unload_contact")),
+]
+
+
+def month_range(month: str) -> Tuple[datetime, datetime]:
+    """Межі місяця "РРРР-ММ" як [початок, початок наступного)"""
+    start = datetime.strptime(month, "%Y-%m")
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+
+def previous_month(today: Optional[date] = None) -> str:
+    today = today or date.today()
+    if today.month == 1:
+        return f"{today.year - 1}-12"
+    return f"{today.year}-{today.month - 1:02d}"
+
+
+def _table(rows: Iterable[Dict[str, Any]], counter: List[int]) -> Iterator[List[Any]]:
+    yield [title for title, _ in EXPORT_COLUMNS]
+    for row in rows:
+        counter[0] += 1
+        yield [getter(row) for _, getter in EXPORT_COLUMNS]
+
+
+def write_csv(rows: Iterable[Dict[str, Any]], path: str) -> int:
+    """Записати заявки в CSV рядок за рядком; повертає кількість заявок"""
+    counter = [0]
+    # utf-8-sig - щоб Excel коректно відкривав кирилицю
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerows(_table(rows, counter))
+    return counter[0]
+
+
+def write_xlsx(rows: Iterable[Dict[str, Any]], path: str) -> int:
+    """Записати заявки в XLSX (режим write_only, без зберігання аркуша в пам'яті)"""
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise RuntimeError("openpyxl is not installed, XLSX export is unavailable") from e
+
+    counter = [0]
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Заявки")
+    for values in _table(rows, counter):
+        sheet.append(values)
+    workbook.save(path)
+    return counter[0]
+
+
+def export_applications(
+    path: str,
+    fmt: str = "csv",
+    month: Optional[str] = None,
+    department: Optional[str] = None,
+) -> int:
+    """Вивантажити заявки за місяць (або всі) у файл; блокуючий виклик"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    created_from, created_to = month_range(month) if month else (None, None)
+    rows = db.iter_applications(created_from, created_to, department)
+    writer = write_xlsx if fmt == "xlsx" else write_csv
+    count = writer(rows, path)
+    logger.info(f"Exported {count} applications to {path}")
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Вивантаження заявок у CSV/XLSX")
+    parser.add_argument("--month", help="місяць РРРР-ММ (за замовчуванням - попередній)")
+    parser.add_argument("--all", action="store_true", help="усі заявки без обмеження за датою")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--department", help="лише заявки цього підрозділу")
+    parser.add_argument("-o", "--output", help="шлях до файлу")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    month = None if args.all else (args.month or previous_month())
+    output = args.output or f"applications_{month or 'all'}.{args.format}"
+    count = export_applications(output, args.format, month, args.department)
+    print(f"{count} заявок -> {output}")
+
+
+if __name__ == "__main__":
+    main()
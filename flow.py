@@ -0,0 +1,105 @@
+import itertools
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+Variant = Tuple[bool, ...]
+
+
+@dataclass(frozen=True)
+class SkipRule:
+    """Пропустити питання keys, якщо ознака flag істинна, і записати в них fill"""
+
+    flag: str
+    keys: FrozenSet[str]
+    fill: str = "—"
+
+
+class QuestionFlow:
+    """Послідовність питань, скомпільована в таблиці переходів.
+
+    Ознаки (flags) - булеві функції від даних заявки (швидкий режим, рідкий вантаж...).
+    Для кожної комбінації ознак наперед обчислюється, які питання пропускаються,
+    чим вони заповнюються та яке питання наступне/попереднє, тож перехід - це
+    пошук у таблиці без повторної перевірки правил.
+    """
+
+    def __init__(
+        self,
+        questions: Sequence[Dict[str, Any]],
+        rules: Sequence[SkipRule],
+        flags: Dict[str, Callable[[Dict[str, Any]], bool]],
+    ):
+        self.keys: Tuple[str, ...] = tuple(q["key"] for q in questions)
+        self.index_by_key = {key: idx for idx, key in enumerate(self.keys)}
+        self._flag_funcs = tuple(flags.values())
+        flag_names = tuple(flags)
+        unknown = {rule.flag for rule in rules} - set(flag_names)
+        if unknown:
+            raise ValueError(f"Unknown flow flags: {sorted(unknown)}")
+
+        self._fills: Dict[Variant, Tuple[Optional[str], ...]] = {}
+        self._next: Dict[Variant, Tuple[int, ...]] = {}
+        self._prev: Dict[Variant, Tuple[int, ...]] = {}
+        self._skipped: Dict[Variant, Tuple[Tuple[Tuple[str, str], ...], ...]] = {}
+        for variant in itertools.product((False, True), repeat=len(flag_names)):
+            active = {name for name, on in zip(flag_names, variant) if on}
+            self._compile(variant, [rule for rule in rules if rule.flag in active])
+
+    def _compile(self, variant: Variant, rules: List[SkipRule]) -> None:
+        count = len(self.keys)
+        # Перше правило, що зачіпає питання, визначає значення автозаповнення
+        fills: List[Optional[str]] = [
+            next((rule.fill for rule in rules if key in rule.keys), None) for key in self.keys
+        ]
+
+        next_index = [count] * (count + 1)
+        skipped: List[Tuple[Tuple[str, str], ...]] = [()] * (count + 1)
+        for idx in range(count - 1, -1, -1):
+            if fills[idx] is None:
+                next_index[idx] = idx
+                skipped[idx] = ()
+            else:
+                next_index[idx] = next_index[idx + 1]
+                skipped[idx] = ((self.keys[idx], fills[idx]),) + skipped[idx + 1]
+
+        prev_index = [0] * (count + 1)
+        last_asked = None
+        for idx in range(count + 1):
+            prev_index[idx] = last_asked if last_asked is not None else idx
+            if idx < count and fills[idx] is None:
+                last_asked = idx
+
+        self._fills[variant] = tuple(fills)
+        self._next[variant] = tuple(next_index)
+        self._prev[variant] = tuple(prev_index)
+        self._skipped[variant] = tuple(skipped)
+
+    def variant(self, data: Dict[str, Any]) -> Variant:
+        return tuple(bool(func(data)) for func in self._flag_funcs)
+
+    def should_skip(self, key: str, data: Dict[str, Any]) -> bool:
+        idx = self.index_by_key.get(key)
+        if idx is None:
+            return False
+        return self._fills[self.variant(data)][idx] is not None
+
+    def advance(self, index: int, data: Dict[str, Any]) -> int:
+        """Наступне питання, яке треба поставити, починаючи з index (пропущені заповнюються в data)"""
+        if index >= len(self.keys):
+            return len(self.keys)
+        variant = self.variant(data)
+        for key, value in self._skipped[variant][index]:
+            data[key] = value
+        return self._next[variant][index]
+
+    def next_missing(self, index: int, data: Dict[str, Any]) -> int:
+        """Як advance, але пропускає й питання, на які в data вже є відповідь"""
+        index = self.advance(index, data)
+        while index < len(self.keys) and data.get(self.keys[index]):
+            index = self.advance(index + 1, data)
+        return index
+
+    def previous_index(self, index: int, data: Dict[str, Any]) -> int:
+        """Попереднє питання, яке ставиться користувачу (index, якщо такого немає)"""
+        index = min(index, len(self.keys))
+        return self._prev[self.variant(data)][index]
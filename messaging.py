@@ -0,0 +1,397 @@
+import os
+import time
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Union
+
+from telegram import Bot, Message
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import metrics
+
+# Загальний ліміт бота: ~30 повідомлень на секунду (з запасом)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+# Особистий чат: 1 повідомлення на секунду, короткі сплески дозволені
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+# Група: не більше 20 повідомлень на хвилину
+OUTBOUND_GROUP_RATE_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_RATE_PER_MINUTE", "20"))
+OUTBOUND_GROUP_BURST = int(os.getenv("OUTBOUND_GROUP_BURST", "3"))
+# Скільки викликів Telegram API виконується одночасно
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+# Скільки разів повторювати виклик після 429 або мережевої помилки
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "5"))
+OUTBOUND_RETRY_BACKOFF = float(os.getenv("OUTBOUND_RETRY_BACKOFF", "1"))
+
+# Менше значення - вищий пріоритет
+PRIORITY_HIGH = 0  # заявки в групу та питання користувачу
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9  # видалення відповідей та echo
+
+# Скільки лімітів чатів тримати, перш ніж прибрати неактивні
+_MAX_IDLE_BUCKETS = 10000
+
+ChatId = Union[int, str]
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Обмеження частоти (rate викликів/сек, сплеск до burst) з бронюванням слотів.
+
+    reserve() одразу займає наступний вільний слот і повертає, скільки до нього
+    чекати, тож виклики одного чату виконуються в порядку бронювання.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.burst = max(burst, 1)
+        self._tat = 0.0  # теоретичний час наступного виклику
+        self._blocked_until = 0.0
+
+    def reserve(self, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        start = max(now, self._blocked_until)
+        if self.interval == 0:
+            return start - now
+        tat = max(self._tat, start)
+        slot = max(start, tat - self.interval * (self.burst - 1))
+        self._tat = tat + self.interval
+        return slot - now
+
+    def wait(self, now: Optional[float] = None) -> float:
+        """Скільки чекати до вільного слоту, не бронюючи його"""
+        now = time.monotonic() if now is None else now
+        start = max(now, self._blocked_until)
+        slot = max(start, self._tat - self.interval * (self.burst - 1))
+        return slot - now
+
+    def block(self, seconds: float) -> None:
+        """Призупинити виклики (Telegram відповів 429 з retry_after)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tat = max(self._tat, self._blocked_until)
+
+    def idle(self, now: float) -> bool:
+        return self._tat <= now and self._blocked_until <= now
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    chat_id: ChatId = field(compare=False)
+    call: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: "asyncio.Future[Any]" = field(compare=False)
+    submitted: float = field(default_factory=time.monotonic, compare=False)
+    attempts: int = field(default=0, compare=False)
+    reserved: bool = field(default=False, compare=False)
+
+
+class OutboundScheduler:
+    """Єдина черга вихідних викликів Telegram API.
+
+    Виклики виконуються за пріоритетом із лімітами на кожен чат, групу та бота
+    загалом. На 429 (RetryAfter) чат призупиняється на вказаний час, а виклик
+    повторюється; мережеві помилки повторюються з затримкою.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        chat_rate: float = OUTBOUND_CHAT_RATE,
+        chat_burst: int = OUTBOUND_CHAT_BURST,
+        group_rate_per_minute: float = OUTBOUND_GROUP_RATE_PER_MINUTE,
+        group_burst: int = OUTBOUND_GROUP_BURST,
+        workers: int = OUTBOUND_WORKERS,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        retry_backoff: float = OUTBOUND_RETRY_BACKOFF,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60.0
+        self.group_burst = group_burst
+        self.workers = max(workers, 1)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._global = TokenBucket(global_rate, max(int(global_rate), 1))
+        self._buckets: Dict[ChatId, TokenBucket] = {}
+        self._queue: "asyncio.PriorityQueue[_Job]" = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._tasks: list = []
+        self._futures: Set["asyncio.Future[Any]"] = set()
+        self._delayed = 0
+        self._in_flight = 0
+        self._stats = {"sent": 0, "retried": 0, "rate_limited": 0, "failed": 0}
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дочекатися поставлених викликів (не довше timeout) та зупинити воркери"""
+        pending = [future for future in self._futures if not future.done()]
+        if pending:
+            _, not_done = await asyncio.wait(pending, timeout=timeout)
+            if not_done:
+                logger.warning(f"Outbound queue not drained, {len(not_done)} calls dropped")
+                for future in not_done:
+                    future.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(
+        self,
+        chat_id: ChatId,
+        call: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_NORMAL,
+    ) -> "asyncio.Future[Any]":
+        """Поставити виклик у чергу; future отримає результат або виняток"""
+        future = asyncio.get_running_loop().create_future()
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        self._queue.put_nowait(_Job(priority, next(self._seq), chat_id, call, future))
+        return future
+
+    async def send_message(self, chat_id: ChatId, text: str, priority: int = PRIORITY_NORMAL, **kwargs: Any) -> Message:
+        return await self.submit(
+            chat_id,
+            lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs),
+            priority,
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "delayed": self._delayed,
+            "in_flight": self._in_flight,
+            "chats": len(self._buckets),
+            **self._stats,
+        }
+
+    def _bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                for key in [key for key, b in self._buckets.items() if b.idle(now)]:
+                    del self._buckets[key]
+            # Від'ємний chat_id або @username - група чи канал
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _requeue(self, job: _Job, delay: float) -> None:
+        if delay <= 0:
+            self._queue.put_nowait(job)
+            return
+        self._delayed += 1
+
+        def put_back() -> None:
+            self._delayed -= 1
+            self._queue.put_nowait(job)
+
+        asyncio.get_running_loop().call_later(delay, put_back)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._execute(job)
+            except Exception as e:
+                logger.error(f"Outbound call failed unexpectedly: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, job: _Job) -> None:
+        if job.future.done():
+            # Той, хто чекав, уже скасував виклик
+            return
+        if not job.reserved:
+            bucket = self._bucket(job.chat_id)
+            if job.priority > PRIORITY_HIGH:
+                # Фонові виклики не бронюють слот наперед, інакше питання користувачу
+                # чекало б за прибиранням попередньої відповіді
+                wait = bucket.wait()
+                if wait > 0:
+                    self._requeue(job, wait)
+                    return
+            job.reserved = True
+            delay = bucket.reserve()
+            if delay > 0:
+                # Слот чату заброньовано - воркер вільний для інших чатів
+                self._requeue(job, delay)
+                return
+        job.reserved = False
+
+        delay = self._global.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if job.attempts == 0:
+            metrics.OUTBOUND_WAIT.observe(time.monotonic() - job.submitted, str(job.priority))
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            self._stats["rate_limited"] += 1
+            logger.warning(f"Flood control for chat {job.chat_id}, retry in {e.retry_after}s")
+            self._bucket(job.chat_id).block(float(e.retry_after))
+            self._retry(job, e, 0)
+        except BadRequest as e:
+            self._fail(job, e)
+        except NetworkError as e:
+            self._retry(job, e, self.retry_backoff * (2 ** job.attempts))
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self._stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            metrics.TELEGRAM_LATENCY.observe(time.perf_counter() - started)
+
+    def _retry(self, job: _Job, error: Exception, delay: float) -> None:
+        if job.attempts >= self.max_retries:
+            self._fail(job, error)
+            return
+        job.attempts += 1
+        self._stats["retried"] += 1
+        self._requeue(job, delay)
+
+    def _fail(self, job: _Job, error: Exception) -> None:
+        self._stats["failed"] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+
+class CleanupPipeline:
+    """Фонове видалення повідомлень та echo-відповіді ("✅ значення")
+
+    Обробник ставить операції в чергу і одразу надсилає наступне питання,
+    а видалення/echo виконуються планувальником з найнижчим пріоритетом.
+    """
+
+    def __init__(self, scheduler: OutboundScheduler):
+        self.scheduler = scheduler
+        self._pending: Set["asyncio.Future[Any]"] = set()
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Дочекатися поставлених операцій (не довше timeout)"""
+        pending = [future for future in self._pending if not future.done()]
+        if not pending:
+            return
+        _, not_done = await asyncio.wait(pending, timeout=timeout)
+        if not_done:
+            logger.warning(f"Cleanup queue not drained, {len(not_done)} operations dropped")
+            for future in not_done:
+                future.cancel()
+
+    def qsize(self) -> int:
+        return len(self._pending)
+
+    def delete(self, chat_id: int, *message_ids: Optional[int]) -> None:
+        for message_id in message_ids:
+            if message_id:
+                self._submit(chat_id, self._delete_call(chat_id, message_id))
+
+    def echo(self, chat_id: int, text: str, replace_message_id: Optional[int] = None) -> None:
+        """Показати відповідь: замінити текст попереднього питання або надіслати нове повідомлення"""
+        self._submit(chat_id, self._echo_call(chat_id, text, replace_message_id))
+
+    def _submit(self, chat_id: int, call: Callable[[], Awaitable[Any]]) -> None:
+        future = self.scheduler.submit(chat_id, call, PRIORITY_LOW)
+        self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: "asyncio.Future[Any]") -> None:
+        self._pending.discard(future)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None and not isinstance(error, BadRequest):
+            # BadRequest - повідомлення вже видалене або застаре, не критично
+            logger.error(f"Помилка при прибиранні повідомлень: {error}")
+
+    def _delete_call(self, chat_id: int, message_id: int) -> Callable[[], Awaitable[Any]]:
+        return lambda: self.scheduler.bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+    def _echo_call(self, chat_id: int, text: str, message_id: Optional[int]) -> Callable[[], Awaitable[Any]]:
+        bot = self.scheduler.bot
+
+        async def call() -> Any:
+            if message_id:
+                try:
+                    return await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+                except BadRequest:
+                    # Не вдалося відредагувати (наприклад, видалене) - надсилаємо нове
+                    pass
+            return await bot.send_message(chat_id=chat_id, text=text)
+
+        return call
+
+
+_scheduler: Optional[OutboundScheduler] = None
+_pipeline: Optional[CleanupPipeline] = None
+
+
+def start_scheduler(bot: Bot) -> OutboundScheduler:
+    """Створити та запустити спільний планувальник (з post_init)"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = OutboundScheduler(bot)
+    _scheduler.start()
+    return _scheduler
+
+
+def get_scheduler(bot: Bot) -> OutboundScheduler:
+    """Спільний планувальник; запускається ліниво, якщо post_init ще не викликано"""
+    if _scheduler is None:
+        return start_scheduler(bot)
+    return _scheduler
+
+
+def scheduler_stats() -> Optional[Dict[str, int]]:
+    return _scheduler.stats() if _scheduler is not None else None
+
+
+async def stop_scheduler() -> None:
+    """Дочекатися черги та зупинити планувальник (з post_stop)"""
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
+
+
+def start_pipeline(bot: Bot) -> CleanupPipeline:
+    """Створити спільний конвеєр прибирання поверх планувальника"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = CleanupPipeline(get_scheduler(bot))
+    return _pipeline
+
+
+def get_pipeline(bot: Bot) -> CleanupPipeline:
+    if _pipeline is None:
+        return start_pipeline(bot)
+    return _pipeline
+
+
+async def stop_pipeline() -> None:
+    """Дочекатися операцій прибирання (з post_stop, до зупинки планувальника)"""
+    global _pipeline
+    if _pipeline is not None:
+        await _pipeline.stop()
+        _pipeline = None
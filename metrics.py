@@ -0,0 +1,347 @@
+import os
+import time
+import logging
+import functools
+import threading
+from collections import Counter as _Tally
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+# Порт окремого HTTP-сервера метрик (0 - не запускати). Це єдине місце, де доступний /metrics:
+# на публічному порту вебхука його немає, тож у режимі вебхука порт має відрізнятися від PORT
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "0.0.0.0")
+METRICS_PATH = "/metrics"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+logger = logging.getLogger(__name__)
+
+_registry: List["_Metric"] = []
+_stats_sources: Dict[str, Callable[[], Optional[Dict[str, Any]]]] = {}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Значення змінюються з потоків БД
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Лічильник, що лише зростає"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}" for labels, v in items]
+
+
+class Gauge(_Metric):
+    """Поточне значення; callback обчислює значення за мітками в момент збору"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Dict[Labels, float]]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        if self._callback is not None:
+            values = self._callback()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+            for labels, v in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Розподіл тривалостей за кошиками (кумулятивно, як очікує Prometheus)"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # мітки -> (лічильники по кошиках, сума, кількість)
+        self._values: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, ([*counts], total, count)) for labels, (counts, total, count) in self._values.items())
+        lines = []
+        inf_label = 'le="+Inf"'
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, inf_label)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def register_stats(prefix: str, source: Callable[[], Optional[Dict[str, Any]]]) -> None:
+    """Віддавати числові поля словника source() як gauge з назвами prefix_<ключ>"""
+    _stats_sources[prefix] = source
+
+
+def _render_stats() -> List[str]:
+    lines = []
+    for prefix, source in _stats_sources.items():
+        try:
+            stats = source()
+        except Exception as e:
+            logger.error(f"Metrics source {prefix} failed: {e}")
+            continue
+        for key, value in sorted((stats or {}).items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(value)}")
+    return lines
+
+
+def render() -> str:
+    """Усі метрики у текстовому форматі Prometheus"""
+    lines: List[str] = []
+    for metric in _registry:
+        lines += metric.render()
+    lines += _render_stats()
+    return "\n".join(lines) + "\n"
+
+
+# Метрики бота
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds", "Час обробки оновлення обробником стану розмови", ("state", "handler")
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Винятки в обробниках стану розмови", ("state", "handler")
+)
+DB_LATENCY = Histogram(
+    "bot_db_call_duration_seconds", "Час виклику функції db.py (разом з очікуванням потоку та з'єднання)", ("function",)
+)
+DB_ERRORS = Counter("bot_db_call_errors_total", "Винятки у функціях db.py", ("function",))
+CITY_SEARCH_LATENCY = Histogram("bot_city_search_duration_seconds", "Час пошуку населеного пункту")
+NOVAPOSHTA_LATENCY = Histogram(
+    "bot_novaposhta_request_duration_seconds", "Час виклику API Нової Пошти з повторами", ("method",)
+)
+NOVAPOSHTA_ERRORS = Counter("bot_novaposhta_errors_total", "Невдалі виклики API Нової Пошти", ("method",))
+TELEGRAM_LATENCY = Histogram("bot_telegram_call_duration_seconds", "Час виклику Telegram Bot API з планувальника")
+OUTBOUND_WAIT = Histogram(
+    "bot_outbound_queue_wait_seconds",
+    "Час від постановки виклику в чергу до його виконання",
+    ("priority",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+
+class ConversationTracker:
+    """Поточний стан кожної розмови - для gauge кількості активних розмов за станами"""
+
+    def __init__(self, end_state: int = -1):
+        self.end_state = end_state
+        self.state_names: Dict[int, str] = {}
+        self._states: Dict[Hashable, int] = {}
+        Gauge(
+            "bot_active_conversations",
+            "Кількість розмов у кожному стані",
+            ("state",),
+            callback=self._counts,
+        )
+
+    def set_state_names(self, state_names: Dict[int, str]) -> None:
+        self.state_names = dict(state_names)
+
+    def state_of(self, key: Hashable) -> Optional[str]:
+        state = self._states.get(key)
+        return None if state is None else self.state_names.get(state, str(state))
+
+    def observe(self, key: Hashable, new_state: Optional[object]) -> None:
+        if new_state is None:
+            return
+        if new_state == self.end_state:
+            self._states.pop(key, None)
+        elif isinstance(new_state, int):
+            self._states[key] = new_state
+
+    def _counts(self) -> Dict[Labels, float]:
+        counts = _Tally(self._states.values())
+        return {(name,): counts.get(state, 0) for state, name in self.state_names.items()}
+
+
+CONVERSATIONS = ConversationTracker()
+
+
+def timed(histogram: Histogram, *labels: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Декоратор корутини: записати тривалість виклику в histogram"""
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with histogram.time(*labels):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_handler(
+    callback: Callable[..., Any],
+    state: str,
+    tracker: Optional[ConversationTracker] = None,
+) -> Callable[..., Any]:
+    """Обгорнути обробник ConversationHandler: час, винятки та новий стан розмови"""
+    name = getattr(callback, "__name__", "handler")
+
+    @functools.wraps(callback)
+    async def wrapper(update: Any, context: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(state, name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, state, name)
+        if tracker is not None:
+            chat = getattr(update, "effective_chat", None)
+            user = getattr(update, "effective_user", None)
+            if chat is not None and user is not None:
+                tracker.observe((chat.id, user.id), result)
+        return result
+
+    return wrapper
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+def add_routes(web_app: web.Application) -> None:
+    web_app.router.add_get(METRICS_PATH, _handle_metrics)
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_server(port: int = METRICS_PORT, listen: str = METRICS_LISTEN) -> None:
+    """Окремий HTTP-сервер з /metrics (не на публічному порту вебхука)"""
+    global _runner
+    if _runner is not None or not port:
+        return
+    web_app = web.Application()
+    add_routes(web_app)
+    _runner = web.AppRunner(web_app)
+    await _runner.setup()
+    await web.TCPSite(_runner, listen, port).start()
+    logger.info(f"Metrics server listening on {listen}:{port}{METRICS_PATH}")
+
+
+async def stop_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,153 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+import metrics
+
+NOVAPOSHTA_API_URL = os.getenv("NOVAPOSHTA_API_URL", "https://api.novaposhta.ua/v2.0/json/")
+# Таймаут однієї спроби та загальний бюджет часу разом з повторами, сек
+NOVAPOSHTA_REQUEST_TIMEOUT = float(os.getenv("NOVAPOSHTA_REQUEST_TIMEOUT", "3"))
+NOVAPOSHTA_TOTAL_TIMEOUT = float(os.getenv("NOVAPOSHTA_TOTAL_TIMEOUT", "8"))
+NOVAPOSHTA_CONNECT_TIMEOUT = float(os.getenv("NOVAPOSHTA_CONNECT_TIMEOUT", "2"))
+# Скільки запитів до API може виконуватися одночасно
+NOVAPOSHTA_MAX_CONCURRENCY = int(os.getenv("NOVAPOSHTA_MAX_CONCURRENCY", "10"))
+NOVAPOSHTA_RETRIES = int(os.getenv("NOVAPOSHTA_RETRIES", "2"))
+NOVAPOSHTA_RETRY_BACKOFF = float(os.getenv("NOVAPOSHTA_RETRY_BACKOFF", "0.3"))
+
+logger = logging.getLogger(__name__)
+
+# Статуси, при яких є сенс повторити запит
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class NovaPoshtaError(RuntimeError):
+    """Помилка звернення до API Нової Пошти"""
+
+
+class NovaPoshtaClient:
+    """Довгоживучий HTTP-клієнт API Нової Пошти з keep-alive з'єднаннями"""
+
+    def __init__(
+        self,
+        api_key: str,
+        url: str = NOVAPOSHTA_API_URL,
+        request_timeout: float = NOVAPOSHTA_REQUEST_TIMEOUT,
+        total_timeout: float = NOVAPOSHTA_TOTAL_TIMEOUT,
+        connect_timeout: float = NOVAPOSHTA_CONNECT_TIMEOUT,
+        max_concurrency: int = NOVAPOSHTA_MAX_CONCURRENCY,
+        retries: int = NOVAPOSHTA_RETRIES,
+        retry_backoff: float = NOVAPOSHTA_RETRY_BACKOFF,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.request_timeout = request_timeout
+        self.total_timeout = total_timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> None:
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.request_timeout,
+            connect=self.connect_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def call(self, model_name: str, called_method: str, properties: Dict[str, Any]) -> Dict[str, Any]:
+        """Виклик методу API з повторами та загальним таймаутом"""
+        if self._session is None:
+            await self.start()
+        payload = {
+            "apiKey": self.api_key,
+            "modelName": model_name,
+            "calledMethod": called_method,
+            "methodProperties": properties,
+        }
+        try:
+            with metrics.NOVAPOSHTA_LATENCY.time(called_method):
+                return await asyncio.wait_for(self._call_with_retries(payload), self.total_timeout)
+        except asyncio.TimeoutError as e:
+            metrics.NOVAPOSHTA_ERRORS.inc(called_method)
+            raise NovaPoshtaError(f"{called_method} timed out after {self.total_timeout}s") from e
+        except NovaPoshtaError:
+            metrics.NOVAPOSHTA_ERRORS.inc(called_method)
+            raise
+
+    async def _call_with_retries(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    async with self._session.post(self.url, json=payload) as response:
+                        if response.status in _RETRY_STATUSES:
+                            raise NovaPoshtaError(f"HTTP {response.status}")
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, NovaPoshtaError) as e:
+                if attempt >= self.retries:
+                    raise NovaPoshtaError(f"{payload['calledMethod']} failed: {e}") from e
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning(f"Nova Poshta request failed ({e}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def search_settlements(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Пошук населених пунктів (Address.searchSettlements)"""
+        data = await self.call(
+            "Address",
+            "searchSettlements",
+            {"CityName": query, "Limit": str(limit)},
+        )
+        if not data.get("success"):
+            return []
+        return (data.get("data") or [{}])[0].get("Addresses", [])
+
+
+_client: Optional[NovaPoshtaClient] = None
+
+
+async def start_client() -> Optional[NovaPoshtaClient]:
+    """Створити спільний клієнт (викликається з post_init)"""
+    global _client
+    if _client is None:
+        api_key = os.getenv("NOVAPOSHTA_API_KEY")
+        if not api_key:
+            logger.error("NOVAPOSHTA_API_KEY не встановлено")
+            return None
+        _client = NovaPoshtaClient(api_key)
+        await _client.start()
+    return _client
+
+
+async def get_client() -> Optional[NovaPoshtaClient]:
+    """Спільний клієнт; створюється ліниво, якщо post_init ще не викликано"""
+    if _client is None:
+        return await start_client()
+    return _client
+
+
+async def close_client() -> None:
+    """Закрити спільний клієнт (викликається з post_shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
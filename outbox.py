@@ -0,0 +1,195 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden
+
+import db
+import messaging
+
+# Скільки заявок брати з черги за один прохід
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "10"))
+# Як часто перевіряти чергу, якщо нових заявок не надходило, сек
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+# Скільки заявка вважається зайнятою одним процесом, сек
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+# Після скількох невдалих спроб заявка позначається як failed
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+OUTBOX_RETRY_BACKOFF = float(os.getenv("OUTBOX_RETRY_BACKOFF", "5"))
+OUTBOX_MAX_RETRY_DELAY = float(os.getenv("OUTBOX_MAX_RETRY_DELAY", "600"))
+
+# Помилки, які повтор не виправить (гілку чи чат видалено, бота вилучено з групи)
+PERMANENT_ERRORS = (BadRequest, Forbidden)
+
+FAILURE_NOTICE = "❌ Заявку не вдалося доставити в групу. Надішліть її ще раз або зверніться до адміністратора."
+MAX_MESSAGE_LENGTH = 4096
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxDispatcher:
+    """Фонова доставка заявок з таблиці applications у групу.
+
+    Обробник лише записує заявку в БД і будить диспетчер; надсилання йде
+    через планувальник з найвищим пріоритетом, а невдалі спроби повторюються
+    з наростаючою затримкою, доки не буде вичерпано OUTBOX_MAX_ATTEMPTS.
+    Постійні помилки Telegram (PERMANENT_ERRORS) не повторюються; про остаточно
+    не доставлену заявку бот повідомляє користувача, який її подав.
+    """
+
+    def __init__(
+        self,
+        scheduler: messaging.OutboundScheduler,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        lease_seconds: float = OUTBOX_LEASE_SECONDS,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ):
+        self.scheduler = scheduler
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._stats = {"sent": 0, "retried": 0, "failed": 0}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Завершити поточний прохід і зупинитися (решта заявок лишається в БД)"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await self._task
+        except Exception as e:
+            logger.error(f"Outbox dispatcher stopped with error: {e}")
+        self._task = None
+
+    def notify(self) -> None:
+        """Нова заявка в черзі - не чекати наступного опитування"""
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                processed = await self.dispatch_once()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}")
+                processed = 0
+            if processed >= self.batch_size:
+                # Черга ще не порожня - одразу наступний прохід
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_once(self) -> int:
+        """Надіслати одну пачку заявок; повертає кількість взятих заявок"""
+        rows = await db.claim_applications(self.batch_size, self.lease_seconds)
+        if not rows:
+            return 0
+        results = await asyncio.gather(*(self._send(row) for row in rows), return_exceptions=True)
+
+        sent: List[tuple] = []
+        failed: List[tuple] = []
+        given_up: List[Dict[str, Any]] = []
+        for row, result in zip(rows, results):
+            if isinstance(result, BaseException):
+                delay = None if isinstance(result, PERMANENT_ERRORS) else self._retry_delay(row["attempts"])
+                failed.append((row["id"], str(result)[:500], delay))
+                if delay is None:
+                    given_up.append(row)
+                    logger.error(
+                        f"Application {row['id']} ({row['idempotency_key']}) not delivered "
+                        f"after {row['attempts']} attempts, giving up: {result}"
+                    )
+                else:
+                    logger.warning(f"Application {row['id']} not delivered, retry in {delay:.0f}s: {result}")
+            else:
+                sent.append((row["id"], result.message_id))
+
+        self._stats["sent"] += len(sent)
+        self._stats["failed"] += len(given_up)
+        self._stats["retried"] += len(failed) - len(given_up)
+        # Якщо запис не вдався, заявки повернуться в чергу після закінчення оренди
+        if await db.complete_applications(sent, failed):
+            for row in given_up:
+                self._notify_failure(row)
+        return len(rows)
+
+    def _notify_failure(self, row: Dict[str, Any]) -> None:
+        """Повідомити автора заявки, що її не доставлено (у фоні, без очікування)"""
+        user_id = row["user_id"]
+        text = f"{FAILURE_NOTICE}\n\n{row['text']}"[:MAX_MESSAGE_LENGTH]
+        future = self.scheduler.submit(
+            user_id,
+            lambda: self.scheduler.bot.send_message(chat_id=user_id, text=text),
+            messaging.PRIORITY_NORMAL,
+        )
+
+        def done(future: "asyncio.Future[Any]") -> None:
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"Failed to notify user {user_id} about application {row['id']}: {future.exception()}")
+
+        future.add_done_callback(done)
+
+    async def _send(self, row: Dict[str, Any]) -> Any:
+        chat_id = row["chat_id"]
+        try:
+            chat_id = int(chat_id)
+        except ValueError:
+            # @username каналу
+            pass
+        return await self.scheduler.send_message(
+            chat_id=chat_id,
+            text=row["text"],
+            message_thread_id=row["thread_id"],
+            priority=messaging.PRIORITY_HIGH,
+        )
+
+    def _retry_delay(self, attempts: int) -> Optional[float]:
+        if attempts >= self.max_attempts:
+            return None
+        return min(OUTBOX_RETRY_BACKOFF * (2 ** (attempts - 1)), OUTBOX_MAX_RETRY_DELAY)
+
+
+_dispatcher: Optional[OutboxDispatcher] = None
+
+
+def start_dispatcher(scheduler: messaging.OutboundScheduler) -> OutboxDispatcher:
+    """Створити та запустити спільний диспетчер (з post_init)"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboxDispatcher(scheduler)
+    _dispatcher.start()
+    return _dispatcher
+
+
+def notify() -> None:
+    if _dispatcher is not None:
+        _dispatcher.notify()
+
+
+def dispatcher_stats() -> Optional[Dict[str, int]]:
+    return _dispatcher.stats() if _dispatcher is not None else None
+
+
+async def stop_dispatcher() -> None:
+    """Зупинити диспетчер (з post_stop, до зупинки планувальника)"""
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+        _dispatcher = None
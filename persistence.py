@@ -0,0 +1,133 @@
+import os
+import copy
+import json
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db
+
+# Як часто Application передає змінені дані в persistence, сек
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "30"))
+# Скільки чекати після першої зміни, щоб зібрати всі зміни в один запис
+PERSISTENCE_FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "0.5"))
+
+USER_DATA_KIND = "user_data"
+
+ConversationKey = Tuple[int, ...]
+
+logger = logging.getLogger(__name__)
+
+
+def _conversation_kind(name: str) -> str:
+    return f"conversation:{name}"
+
+
+def _encode_key(key: ConversationKey) -> str:
+    return json.dumps(list(key))
+
+
+def _decode_key(key: str) -> ConversationKey:
+    return tuple(json.loads(key))
+
+
+class DBPersistence(BasePersistence):
+    """Збереження user_data та станів розмов у PostgreSQL (через db.py).
+
+    Зміни накопичуються в пам'яті і записуються однією транзакцією:
+    Application викликає update_* раз на update_interval, а ми ще й об'єднуємо
+    всі ці виклики в один пакетний запис.
+    """
+
+    def __init__(
+        self,
+        update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+        flush_delay: float = PERSISTENCE_FLUSH_DELAY,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.flush_delay = flush_delay
+        # (kind, key) -> дані; None означає видалення
+        self._pending: Dict[Tuple[str, str], Optional[Any]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _mark(self, kind: str, key: str, data: Optional[Any]) -> None:
+        """Поставити в чергу запису знімок data (не живий об'єкт обробників)"""
+        self._pending[(kind, key)] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        await self._write_pending()
+
+    async def _write_pending(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        upserts = [(kind, key, data) for (kind, key), data in pending.items() if data is not None]
+        deletes = [(kind, key) for (kind, key), data in pending.items() if data is None]
+        if not await db.save_persistence_batch(upserts, deletes):
+            # Не вдалося записати - повернути в чергу, новіші зміни мають пріоритет
+            for item_key, data in pending.items():
+                self._pending.setdefault(item_key, data)
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        rows = await db.load_persistence(USER_DATA_KIND)
+        return {int(key): data for key, data in rows.items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[ConversationKey, object]:
+        rows = await db.load_persistence(_conversation_kind(name))
+        return {_decode_key(key): state for key, state in rows.items()}
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        self._mark(_conversation_kind(name), _encode_key(key), copy.deepcopy(new_state))
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        # Знімок на event loop: запис серіалізує дані в потоці БД, поки обробники
+        # продовжують змінювати той самий словник
+        self._mark(USER_DATA_KIND, str(user_id), copy.deepcopy(data))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark(USER_DATA_KIND, str(user_id), None)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        # chat_data не зберігається (store_data.chat_data=False)
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Записати все накопичене (викликається при зупинці бота)"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._write_pending()
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from novaposhta import NovaPoshtaClient
+
+# Локальний дамп довідника населених пунктів Нової Пошти
+SETTLEMENTS_DUMP_PATH = os.getenv("SETTLEMENTS_DUMP_PATH", "settlements.json")
+# Як часто оновлювати дамп з API, год (0 - не оновлювати)
+SETTLEMENTS_REFRESH_HOURS = float(os.getenv("SETTLEMENTS_REFRESH_HOURS", "24"))
+SETTLEMENTS_PAGE_SIZE = 150
+
+# Верхня межа кандидатів з префіксного діапазону для однолітерних запитів
+_MAX_CANDIDATES = 20000
+# Більший за будь-який символ назви: q + _PREFIX_END - верхня межа ключів з префіксом q
+_PREFIX_END = "\U0010ffff"
+
+logger = logging.getLogger(__name__)
+
+# Скорочення типів як у полі Present відповіді searchSettlements
+_TYPE_ABBREVIATIONS = {
+    "місто": "м.",
+    "селище міського типу": "смт",
+    "селище": "с-ще",
+    "село": "с.",
+}
+# Міста вище за села при однаковій відповідності запиту
+_TYPE_RANK = {"м.": 0, "смт": 1, "с-ще": 2, "с.": 3}
+
+_APOSTROPHES = str.maketrans({"ʼ": "'", "’": "'", "`": "'", "ʻ": "'"})
+
+
+def normalize(text: str) -> str:
+    """Нормалізувати назву/запит для порівняння"""
+    text = (text or "").translate(_APOSTROPHES).casefold().strip()
+    # "м. Вінниця, Вінницька обл." -> "вінниця"
+    text = text.split("(", 1)[0].split(",", 1)[0].strip()
+    for abbr in _TYPE_RANK:
+        if text.startswith(abbr + " "):
+            text = text[len(abbr) + 1:].strip()
+            break
+    return " ".join(text.split())
+
+
+def record_from_api(item: Dict[str, Any]) -> Dict[str, str]:
+    """Запис Address.getSettlements -> формат адреси searchSettlements"""
+    name = item.get("Description", "")
+    type_abbr = _TYPE_ABBREVIATIONS.get((item.get("SettlementTypeDescription") or "").lower(), "")
+    area = item.get("AreaDescription", "")
+    region = item.get("RegionsDescription", "")
+    parts = [f"{type_abbr} {name}".strip()]
+    if region:
+        parts.append(f"{region} р-н")
+    if area:
+        parts.append(f"{area} обл.")
+    return {
+        "Present": ", ".join(parts),
+        "MainDescription": name,
+        "SettlementTypeCode": type_abbr,
+        "Area": area,
+        "Region": region,
+    }
+
+
+class SettlementIndex:
+    """Префіксний індекс населених пунктів у пам'яті (bisect по відсортованих словах)"""
+
+    def __init__(self, records: List[Dict[str, str]]):
+        self.records = records
+        entries: List[Tuple[str, int, int]] = []
+        for idx, record in enumerate(records):
+            name = normalize(record.get("MainDescription") or record.get("Present", ""))
+            if not name:
+                continue
+            # Повна назва та кожне слово окремо ("Нові Млини" шукається і за "млини")
+            entries.append((name, idx, 0))
+            words = name.replace("-", " ").split()
+            for position, word in enumerate(words[1:], start=1):
+                entries.append((word, idx, position))
+        entries.sort()
+        self._keys = [e[0] for e in entries]
+        self._entries = entries
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        q = normalize(query)
+        if not q:
+            return []
+        best: Dict[int, Tuple] = {}
+        entries = self._entries
+        start = bisect_left(self._keys, q)
+        # Кінець діапазону ключів з префіксом q - без копіювання зрізу на кожне натискання
+        end = min(bisect_left(self._keys, q + _PREFIX_END, start), start + _MAX_CANDIDATES)
+        for i in range(start, end):
+            key, idx, position = entries[i]
+            record = self.records[idx]
+            # Точний збіг > початок назви > початок іншого слова
+            match_rank = 0 if key == q and position == 0 else (1 if position == 0 else 2)
+            rank = (
+                match_rank,
+                _TYPE_RANK.get(record.get("SettlementTypeCode", ""), len(_TYPE_RANK)),
+                len(record.get("MainDescription", "")),
+                record.get("Present", ""),
+            )
+            if idx not in best or rank < best[idx]:
+                best[idx] = rank
+        ordered = heapq.nsmallest(limit, best, key=best.__getitem__)
+        return [self.records[idx] for idx in ordered]
+
+
+_index: Optional[SettlementIndex] = None
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def get_index() -> Optional[SettlementIndex]:
+    return _index
+
+
+def search(query: str, limit: int = 10) -> List[Dict[str, str]]:
+    """Пошук у локальному індексі ([] якщо індекс не завантажено)"""
+    if _index is None:
+        return []
+    return _index.search(query, limit)
+
+
+def load_dump(path: str = SETTLEMENTS_DUMP_PATH) -> bool:
+    """Завантажити індекс з локального дампу"""
+    global _index
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+        _index = SettlementIndex(records)
+        logger.info(f"Settlement index loaded: {len(_index)} records from {path}")
+        return True
+    except Exception as e:
+        logger.error(f"Error loading settlements dump: {e}")
+        return False
+
+
+async def fetch_all(client: NovaPoshtaClient) -> List[Dict[str, str]]:
+    """Завантажити весь довідник населених пунктів з API посторінково"""
+    records: List[Dict[str, str]] = []
+    page = 1
+    while True:
+        data = await client.call(
+            "Address",
+            "getSettlements",
+            {"Page": str(page), "Limit": str(SETTLEMENTS_PAGE_SIZE)},
+        )
+        items = data.get("data") or []
+        if not data.get("success") or not items:
+            break
+        records.extend(record_from_api(item) for item in items)
+        if len(items) < SETTLEMENTS_PAGE_SIZE:
+            break
+        page += 1
+    return records
+
+
+def _write_dump(records: List[Dict[str, str]], path: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+async def refresh(client: NovaPoshtaClient, path: str = SETTLEMENTS_DUMP_PATH) -> bool:
+    """Оновити дамп з API та замінити індекс"""
+    global _index
+    started = time.monotonic()
+    try:
+        records = await fetch_all(client)
+    except Exception as e:
+        logger.error(f"Error refreshing settlements: {e}")
+        return False
+    if not records:
+        return False
+
+    _index = await asyncio.to_thread(SettlementIndex, records)
+    try:
+        await asyncio.to_thread(_write_dump, records, path)
+    except OSError as e:
+        logger.warning(f"Could not save settlements dump: {e}")
+    logger.info(f"Settlement index refreshed: {len(records)} records in {time.monotonic() - started:.1f}s")
+    return True
+
+
+async def _refresh_loop(client: NovaPoshtaClient) -> None:
+    interval = SETTLEMENTS_REFRESH_HOURS * 3600
+    # Дамп старший за інтервал (або відсутній) - оновлюємо одразу
+    try:
+        age = time.time() - os.path.getmtime(SETTLEMENTS_DUMP_PATH)
+    except OSError:
+        age = interval
+    delay = max(interval - age, 0)
+    while True:
+        await asyncio.sleep(delay)
+        await refresh(client)
+        delay = interval
+
+
+def start_refresh(client: Optional[NovaPoshtaClient]) -> None:
+    """Завантажити дамп і запустити періодичне оновлення (з post_init)"""
+    global _refresh_task
+    load_dump()
+    if client is None or SETTLEMENTS_REFRESH_HOURS <= 0 or _refresh_task is not None:
+        return
+    _refresh_task = asyncio.create_task(_refresh_loop(client))
+
+
+async def stop_refresh() -> None:
+    """Зупинити періодичне оновлення (з post_shutdown)"""
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
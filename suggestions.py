@@ -0,0 +1,138 @@
+import os
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import db
+from cache import TTLCache
+
+# Скільки персональних варіантів показувати над стандартними кнопками (0 - вимкнено)
+ANSWER_SUGGESTIONS = int(os.getenv("ANSWER_SUGGESTIONS", "3"))
+# За скільки днів вага давньої відповіді зменшується вдвічі
+ANSWER_HALF_LIFE_DAYS = float(os.getenv("ANSWER_HALF_LIFE_DAYS", "30"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+# Вага відповідей колег з підрозділу відносно власних
+DEPARTMENT_WEIGHT = 0.25
+# Скільки найчастіших значень кожного поля тримати в пам'яті
+VALUES_PER_FIELD = 10
+# Довші значення не стають кнопками
+MAX_VALUE_LENGTH = 64
+
+IGNORED_VALUES = frozenset({"", "—", "Пропустити", "Інше", "Ввести своє"})
+
+logger = logging.getLogger(__name__)
+
+# field -> value -> [власні використання, час останнього, використання в підрозділі, час останнього]
+Entry = Dict[str, Dict[str, List[float]]]
+
+
+class AnswerIndex:
+    """Частота та свіжість відповідей користувача і його підрозділу.
+
+    Дані для пари (користувач, підрозділ) завантажуються з answer_stats один раз
+    і далі оновлюються в пам'яті при кожній надісланій заявці, тож підказки до
+    питань не потребують запитів до БД. Без DATABASE_URL індекс живе лише в пам'яті.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        half_life_days: float = ANSWER_HALF_LIFE_DAYS,
+    ):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.half_life = half_life_days * 86400
+
+    async def load(self, user_id: int, department: Optional[str]) -> Entry:
+        key = (user_id, department or "")
+        entry = self._cache.get(key)
+        if entry is not None:
+            return entry
+        entry = {}
+        if db.DATABASE_URL:
+            rows = await db.get_answer_stats(user_id, department, VALUES_PER_FIELD)
+            if rows is None:
+                # БД недоступна - не кешувати порожній індекс
+                return entry
+            now = time.time()
+            for row in rows:
+                offset = 0 if row["personal"] else 2
+                stats = entry.setdefault(row["field"], {}).setdefault(row["value"], [0, 0.0, 0, 0.0])
+                stats[offset] = row["uses"]
+                stats[offset + 1] = now - row["age_seconds"]
+        self._cache.set(key, entry)
+        return entry
+
+    async def record(self, user_id: int, department: Optional[str], data: Dict[str, Any], keys: Iterable[str]) -> None:
+        """Врахувати відповіді надісланої заявки (лише поля keys)"""
+        answers = {
+            key: value.strip()
+            for key in keys
+            if isinstance((value := data.get(key)), str) and self._usable(value.strip())
+        }
+        if not answers:
+            return
+        now = time.time()
+        entry = await self.load(user_id, department)
+        for field, value in answers.items():
+            stats = entry.setdefault(field, {}).setdefault(value, [0, 0.0, 0, 0.0])
+            stats[0] += 1
+            stats[1] = now
+            stats[2] += 1
+            stats[3] = now
+        if db.DATABASE_URL:
+            await db.record_answers(user_id, department, answers)
+
+    def top(self, entry: Entry, field: str, k: int = ANSWER_SUGGESTIONS, exclude: Sequence[str] = ()) -> List[str]:
+        """k найкращих значень поля: частота з урахуванням давності, власні важать більше"""
+        values = entry.get(field)
+        if not values or k <= 0:
+            return []
+        now = time.time()
+        scored: List[Tuple[float, str]] = []
+        for value, (uses, last_used, department_uses, department_last_used) in values.items():
+            if value in exclude:
+                continue
+            score = uses * self._decay(now - last_used)
+            score += DEPARTMENT_WEIGHT * department_uses * self._decay(now - department_last_used)
+            if score > 0:
+                scored.append((score, value))
+        scored.sort(reverse=True)
+        return [value for _, value in scored[:k]]
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+    def _decay(self, age: float) -> float:
+        if self.half_life <= 0:
+            return 1.0
+        return 0.5 ** (max(age, 0.0) / self.half_life)
+
+    @staticmethod
+    def _usable(value: str) -> bool:
+        return value not in IGNORED_VALUES and len(value) <= MAX_VALUE_LENGTH
+
+
+_index = AnswerIndex()
+
+
+async def suggest(user_id: int, department: Optional[str], field: str, exclude: Sequence[str] = ()) -> List[str]:
+    """Персональні варіанти відповіді на питання field"""
+    if ANSWER_SUGGESTIONS <= 0:
+        return []
+    entry = await _index.load(user_id, department)
+    return _index.top(entry, field, ANSWER_SUGGESTIONS, exclude)
+
+
+async def record(user_id: int, department: Optional[str], data: Dict[str, Any], keys: Iterable[str]) -> None:
+    if ANSWER_SUGGESTIONS <= 0:
+        return
+    try:
+        await _index.record(user_id, department, data, keys)
+    except Exception as e:
+        logger.error(f"Failed to record answers for user {user_id}: {e}")
+
+
+def cache_stats() -> Dict[str, int]:
+    return _index.stats()
@@ -0,0 +1,97 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Скільки оновлень (різних користувачів) обробляти одночасно
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+# Скільки оновлень може чекати в обробнику, перш ніж Application призупинить прийом
+UPDATE_BACKLOG_LIMIT = int(os.getenv("UPDATE_BACKLOG_LIMIT", "4096"))
+
+logger = logging.getLogger(__name__)
+
+
+class _KeyQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Паралельна обробка оновлень різних користувачів зі строгим порядком у межах одного.
+
+    Семафор базового класу обмежує лише кількість прийнятих оновлень (backlog),
+    а кількість одночасно виконуваних обмежує власний семафор воркерів. Оновлення,
+    що чекає на попереднє оновлення того самого користувача, не займає воркер.
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, backlog_limit: int = UPDATE_BACKLOG_LIMIT):
+        super().__init__(max(backlog_limit, workers, 2))
+        self.workers = workers
+        self._worker_slots = asyncio.BoundedSemaphore(workers)
+        self._queues: Dict[Hashable, _KeyQueue] = {}
+        self._running = 0
+        self._processed = 0
+
+    @staticmethod
+    def _key(update: object) -> Optional[Hashable]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        key = self._key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _KeyQueue()
+        queue.depth += 1
+        try:
+            # asyncio.Lock віддається в порядку черги - порядок оновлень зберігається
+            async with queue.lock:
+                await self._run(coroutine)
+        finally:
+            queue.depth -= 1
+            if queue.depth == 0:
+                self._queues.pop(key, None)
+
+    async def _run(self, coroutine: "Awaitable[Any]") -> None:
+        async with self._worker_slots:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+                self._processed += 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        """Метрики черги: активні, очікуючі та найдовша черга одного користувача"""
+        depths = [q.depth for q in self._queues.values()]
+        pending = sum(depths)
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "pending": pending,
+            "waiting": max(pending - self._running, 0),
+            "active_users": len(depths),
+            "max_user_depth": max(depths, default=0),
+            "processed_total": self._processed,
+        }
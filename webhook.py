@@ -0,0 +1,139 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+import messaging
+import metrics
+import outbox
+
+# Публічна адреса, на яку Telegram надсилатиме оновлення (https://...)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+# Railway передає порт у змінній PORT
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or "8080")
+# Обов'язковий: однаковий для всіх екземплярів за однією адресою вебхука
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+# Скільки одночасних HTTPS-з'єднань відкриває Telegram (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+HEALTH_PATH = "/healthz"
+
+logger = logging.getLogger(__name__)
+
+_APPLICATION_KEY = web.AppKey("application", Application)
+_SECRET_KEY = web.AppKey("secret_token", str)
+
+
+async def _handle_update(request: web.Request) -> web.Response:
+    """Прийняти оновлення від Telegram та поставити його в чергу Application"""
+    expected = request.app[_SECRET_KEY]
+    received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(received, expected):
+        return web.Response(status=403)
+
+    application = request.app[_APPLICATION_KEY]
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        return web.Response(status=400)
+
+    update = Update.de_json(data, application.bot)
+    # Відповідаємо одразу: обробка йде з черги, Telegram не чекає на неї
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+async def _handle_health(request: web.Request) -> web.Response:
+    application = request.app[_APPLICATION_KEY]
+    status = 200 if application.running else 503
+    payload = {
+        "status": "ok" if application.running else "stopped",
+        "update_queue": application.update_queue.qsize(),
+    }
+    processor_stats = getattr(application.update_processor, "stats", None)
+    if processor_stats:
+        payload["update_processor"] = processor_stats()
+    outbound_stats = messaging.scheduler_stats()
+    if outbound_stats:
+        payload["outbound"] = outbound_stats
+    outbox_stats = outbox.dispatcher_stats()
+    if outbox_stats:
+        payload["outbox"] = outbox_stats
+    return web.json_response(payload, status=status)
+
+
+def build_web_app(application: Application, secret_token: str, path: str = WEBHOOK_PATH) -> web.Application:
+    """aiohttp-застосунок з ендпоінтами вебхука та перевірки стану"""
+    web_app = web.Application()
+    web_app[_APPLICATION_KEY] = application
+    web_app[_SECRET_KEY] = secret_token
+    web_app.router.add_post(path, _handle_update)
+    web_app.router.add_get(HEALTH_PATH, _handle_health)
+    return web_app
+
+
+async def serve(
+    application: Application,
+    url: Optional[str] = WEBHOOK_URL,
+    listen: str = WEBHOOK_LISTEN,
+    port: int = WEBHOOK_PORT,
+    path: str = WEBHOOK_PATH,
+    secret_token: Optional[str] = WEBHOOK_SECRET_TOKEN,
+    max_connections: int = WEBHOOK_MAX_CONNECTIONS,
+) -> None:
+    """Запустити бота у режимі вебхука до SIGINT/SIGTERM"""
+    if not url:
+        raise RuntimeError("WEBHOOK_URL is not set")
+    # Випадковий секрет у кожного процесу: setWebhook останнього екземпляра
+    # змусив би решту відхиляти оновлення
+    if not secret_token:
+        raise RuntimeError("WEBHOOK_SECRET_TOKEN is not set")
+    if metrics.METRICS_PORT == port:
+        raise RuntimeError("METRICS_PORT must differ from the public webhook port")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: обробники сигналів недоступні, зупинка через KeyboardInterrupt
+            pass
+
+    # Той самий життєвий цикл, що й у run_polling (post_init / post_stop / post_shutdown)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.bot.set_webhook(
+        url=url.rstrip("/") + path,
+        secret_token=secret_token,
+        max_connections=max_connections,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    await application.start()
+
+    runner = web.AppRunner(build_web_app(application, secret_token, path))
+    await runner.setup()
+    site = web.TCPSite(runner, listen, port)
+    await site.start()
+    logger.info(f"Webhook server listening on {listen}:{port}{path}")
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)